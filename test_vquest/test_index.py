@@ -0,0 +1,152 @@
+"""
+Test the persistent index of record positions in sequence files.
+"""
+
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from pathlib import Path
+from vquest.index import SequenceIndex
+from vquest.request import vquest
+from .test_vquest import TestVquestBase
+
+FASTA = (
+    ">seq1 first\nACGTACGT\nACGT\n"
+    ">seq2\nTTTT\n"
+    ">seq3\nGGGG\nCC\n"
+    ">seq2\nAAAA")
+
+FASTQ = (
+    "@seq1 first\nACGT\n+\nIIII\n"
+    "@seq2\nTTTT\n+\nIIII\n"
+    "@seq3\nGGGG\n+\nIIII\n")
+
+
+class TestSequenceIndex(unittest.TestCase):
+    """Test SequenceIndex with a FASTA file."""
+
+    fmt = "fasta"
+    text = FASTA
+    seqs = ["ACGTACGTACGT", "TTTT", "GGGGCC", "AAAA"]
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        self.path = Path(self.tempdir.name) / ("seqs." + self.fmt)
+        self.path.write_text(self.text)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_records(self):
+        """Test reading records by position."""
+        index = SequenceIndex.load(self.path, self.fmt)
+        self.assertEqual(index.ids, ["seq1", "seq2", "seq3", "seq2"][:len(self.seqs)])
+        self.assertEqual([str(rec.seq) for rec in index.records()], self.seqs)
+        self.assertEqual([str(rec.seq) for rec in index.records(1, 3)], self.seqs[1:3])
+        self.assertEqual([rec.id for rec in index.chunk(1, 2)], index.ids[2:4])
+        self.assertEqual(index.records()[0].description, "seq1 first")
+
+    def test_get(self):
+        """Test reading records by ID."""
+        index = SequenceIndex.load(self.path, self.fmt)
+        records = index.get(["seq3", "seq1"])
+        self.assertEqual([rec.id for rec in records], ["seq3", "seq1"])
+        self.assertEqual(str(records[0].seq), self.seqs[2])
+        with self.assertRaises(KeyError):
+            index.get(["seq4"])
+
+    def test_reuse(self):
+        """Test that the saved index is reused until the file changes."""
+        SequenceIndex.load(self.path, self.fmt)
+        index_path = Path(str(self.path) + ".vqi")
+        self.assertTrue(index_path.exists())
+        # Tamper with the saved offsets to prove they're what gets used
+        lines = index_path.read_text().splitlines()
+        lines[1] = lines[1].replace("seq1", "seqX")
+        index_path.write_text("\n".join(lines) + "\n")
+        self.assertEqual(SequenceIndex.load(self.path, self.fmt).ids[0], "seqX")
+        # Once the file itself changes the index is rebuilt
+        self.path.write_text(self.text.replace("seq1", "seqAA"))
+        self.assertEqual(SequenceIndex.load(self.path, self.fmt).ids[0], "seqAA")
+
+    def test_truncated(self):
+        """Test that a truncated saved index is rebuilt rather than used."""
+        SequenceIndex.load(self.path, self.fmt)
+        index_path = Path(str(self.path) + ".vqi")
+        text = index_path.read_text()
+        self.assertEqual(
+            sorted(os.listdir(self.tempdir.name)), [self.path.name, index_path.name])
+        # Cut both at a line boundary and partway through a line
+        for cut in (text.index("\n", text.index("\n") + 1) + 1, len(text) - 3):
+            index_path.write_text(text[:cut])
+            with self.assertLogs("vquest.index", "WARNING"):
+                index = SequenceIndex.load(self.path, self.fmt)
+            self.assertEqual(len(index), len(self.seqs))
+            self.assertEqual(index_path.read_text(), text)
+
+    def test_unsaved(self):
+        """Test that an index that can't be saved is still used."""
+        # (A directory in the way makes this fail even when running as root)
+        Path(str(self.path) + ".vqi").mkdir()
+        with self.assertLogs("vquest.index", "WARNING"):
+            index = SequenceIndex.load(self.path, self.fmt)
+        self.assertEqual([str(rec.seq) for rec in index.records()], self.seqs)
+
+    def test_no_id(self):
+        """Test that a record with no ID is rejected."""
+        self.path.write_text(self.text.replace("seq2", "", 1))
+        with self.assertRaises(ValueError):
+            SequenceIndex.build(self.path, self.fmt)
+
+
+class TestSequenceIndexFastq(TestSequenceIndex):
+    """Test SequenceIndex with a FASTQ file."""
+
+    fmt = "fastq"
+    text = FASTQ
+    seqs = ["ACGT", "TTTT", "GGGG"]
+
+    def test_multiline(self):
+        """Test that multi-line FASTQ records are rejected."""
+        self.path.write_text("@seq1\nACGT\nACGT\n+\nIIII\nIIII\n")
+        with self.assertRaises(ValueError):
+            SequenceIndex.build(self.path, self.fmt)
+
+
+class TestIndexVquest(TestVquestBase):
+    """Test vquest() submitting selected sequences via an index."""
+
+    def test_vquest_ids(self):
+        """Test that only the requested IDs are read and submitted."""
+        with tempfile.TemporaryDirectory() as tempdir:
+            os.chdir(tempdir)
+            path = Path("seqs.fasta")
+            path.write_text(">other\nACGT\n" + self.config.pop("sequences"))
+            self.config["fileSequences"] = path
+            result = vquest(self.config, ids=["IGKV2-ACR*02"])
+            self.assertTrue(Path("seqs.fasta.vqi").exists())
+        self.assertEqual(self.post.call_count, 1)
+        self.assertTrue(
+            self.post.call_args.kwargs["data"]["sequences"].startswith(">IGKV2-ACR*02\n"))
+        self.assertEqual(result.column("sequence_id"), ["IGKV2-ACR*02"])
+
+    def test_vquest_index_start_chunk(self):
+        """Test that batches are read via the index, starting partway through."""
+        with tempfile.TemporaryDirectory() as tempdir:
+            os.chdir(tempdir)
+            path = Path("seqs.fasta")
+            path.write_text("".join(">seq%d\nACGT\n" % idx for idx in range(120)))
+            self.config.pop("sequences")
+            self.config["fileSequences"] = path
+            with patch.object(
+                    SequenceIndex, "records", autospec=True,
+                    side_effect=SequenceIndex.records) as records:
+                vquest(self.config, index=True, start_chunk=1, retries=0)
+        self.assertEqual(
+            [call.args[1:] for call in records.call_args_list], [(50, 100), (100, 150)])
+        self.assertEqual(self.post.call_count, 2)
+        sent = [call.kwargs["data"]["sequences"] for call in self.post.call_args_list]
+        self.assertTrue(sent[0].startswith(">seq50\n"))
+        self.assertTrue(sent[1].startswith(">seq100\n"))
+        self.assertEqual(sent[1].count(">"), 20)
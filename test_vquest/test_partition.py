@@ -0,0 +1,143 @@
+"""
+Test partitioned output of AIRR results.
+"""
+
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+from io import StringIO
+from pathlib import Path
+from vquest.partition import PartitionWriter, gene_family, check_columns
+from vquest.util import VquestError
+from vquest.__main__ import main
+from .test_vquest import TestVquestBase
+
+CHUNKS = [
+    {"vquest_airr.tsv": (
+        b"sequence_id\tlocus\tv_call\n"
+        b"seq1\tIGH\tHomsap IGHV4-34*01 F\n"
+        b"seq2\tIGK\tHomsap IGKV1-5*03 F\n")},
+    {"vquest_airr.tsv": (
+        b"sequence_id\tlocus\tv_call\n"
+        b"seq3\tIGH\tHomsap IGHV4-59*01 F, or Homsap IGHV4-59*08 F\n"
+        b"seq4\t\t\n")}]
+
+
+class TestGeneFamily(unittest.TestCase):
+    """Test gene family names from AIRR gene calls."""
+
+    def test_gene_family(self):
+        """Test that the family of the first gene call is given."""
+        self.assertEqual(gene_family("Homsap IGHV4-34*01 F"), "IGHV4")
+        self.assertEqual(gene_family("Macmul IGKV2S20*01 F"), "IGKV2")
+        self.assertEqual(gene_family("Homsap TRBJ2-7*01 F, or Homsap TRBJ1-1*01 F"), "TRBJ2")
+        self.assertEqual(gene_family(""), "")
+
+
+class TestCheckColumns(unittest.TestCase):
+    """Test checking column names for partitioning."""
+
+    def test_check_columns(self):
+        """Test that AIRR columns and gene families are accepted, but not typos."""
+        check_columns(["locus", "v_family", "j_family", "productive"])
+        for column in ["v_famly", "x_family", "sequence_family"]:
+            with self.assertRaises(ValueError):
+                check_columns([column])
+
+
+class TestPartitionWriter(unittest.TestCase):
+    """Test writing AIRR rows split by column values."""
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        self.outdir = Path(self.tempdir.name)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def write(self):
+        """Write the test chunks with a new PartitionWriter."""
+        with PartitionWriter(self.outdir, ["locus", "v_family"]) as writer:
+            for chunk in CHUNKS:
+                writer.add(chunk)
+
+    def test_partition(self):
+        """Test that rows are split into files with a manifest."""
+        self.write()
+        self.assertEqual(
+            (self.outdir / "locus=IGH/v_family=IGHV4/part-000.tsv").read_text(),
+            "sequence_id\tlocus\tv_call\n"
+            "seq1\tIGH\tHomsap IGHV4-34*01 F\n"
+            "seq3\tIGH\tHomsap IGHV4-59*01 F, or Homsap IGHV4-59*08 F\n")
+        self.assertEqual(
+            (self.outdir / "manifest.tsv").read_text(),
+            "path\trows\n"
+            "locus=IGH/v_family=IGHV4/part-000.tsv\t2\n"
+            "locus=IGK/v_family=IGKV1/part-000.tsv\t1\n"
+            "locus=none/v_family=none/part-000.tsv\t1\n")
+
+    def test_partition_append(self):
+        """Test that a second run adds new part files alongside the first."""
+        self.write()
+        self.write()
+        self.assertTrue((self.outdir / "locus=IGH/v_family=IGHV4/part-001.tsv").exists())
+        lines = (self.outdir / "manifest.tsv").read_text().splitlines()
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(lines[-1], "locus=none/v_family=none/part-001.tsv\t1")
+
+    def test_partition_empty(self):
+        """Test that an empty AIRR table is skipped with a warning."""
+        with PartitionWriter(self.outdir, ["locus"]) as writer:
+            with self.assertLogs("vquest.partition", "WARNING"):
+                writer.add({"vquest_airr.tsv": b""})
+            writer.add(CHUNKS[0])
+        self.assertEqual(
+            (self.outdir / "locus=IGH/part-000.tsv").read_text(),
+            "sequence_id\tlocus\tv_call\n"
+            "seq1\tIGH\tHomsap IGHV4-34*01 F\n")
+
+    def test_partition_missing_column(self):
+        """Test that a column absent from the results is named in the error."""
+        with PartitionWriter(self.outdir, ["j_call"]) as writer:
+            with self.assertRaisesRegex(VquestError, "j_call"):
+                writer.add(CHUNKS[0])
+        with PartitionWriter(self.outdir, ["d_family"]) as writer:
+            with self.assertRaisesRegex(VquestError, "d_call"):
+                writer.add(CHUNKS[0])
+
+
+class TestPartitionMain(TestVquestBase):
+    """Test the command-line interface with --partition."""
+
+    def test_vquest_main(self):
+        """Test that partitions are written instead of vquest_airr.tsv."""
+        with tempfile.TemporaryDirectory() as tempdir:
+            os.chdir(tempdir)
+            main([str(self.path / "config.yml"), "--partition", "locus", "v_family"])
+            self.assertFalse(Path("vquest_airr.tsv").exists())
+            self.assertTrue(Path("Parameters.txt").exists())
+            self.assertTrue(Path("locus=IGK/v_family=IGKV2/part-000.tsv").exists())
+            self.assertEqual(
+                Path("manifest.tsv").read_text(),
+                "path\trows\nlocus=IGK/v_family=IGKV2/part-000.tsv\t1\n")
+
+    def test_vquest_main_no_collapse(self):
+        """Test that per-batch AIRR files aren't also written with --no-collapse."""
+        with tempfile.TemporaryDirectory() as tempdir:
+            os.chdir(tempdir)
+            main([str(self.path / "config.yml"), "--no-collapse", "--partition", "locus"])
+            self.assertFalse(Path("001/vquest_airr.tsv").exists())
+            self.assertTrue(Path("001/Parameters.txt").exists())
+            self.assertTrue(Path("locus=IGK/part-000.tsv").exists())
+
+    def test_vquest_main_unknown_column(self):
+        """Test that an unknown column is rejected before anything is sent."""
+        err = StringIO()
+        with tempfile.TemporaryDirectory() as tempdir:
+            os.chdir(tempdir)
+            with redirect_stderr(err), self.assertRaises(SystemExit):
+                main([str(self.path / "config.yml"), "--partition", "v_famly"])
+            self.assertEqual(os.listdir("."), [])
+        self.assertEqual(self.post.call_count, 0)
+        self.assertIn("v_famly", err.getvalue())
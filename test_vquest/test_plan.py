@@ -0,0 +1,72 @@
+"""
+Test planning a run without sending any requests.
+"""
+
+import os
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
+from vquest.plan import plan, LATENCY
+from vquest.server import WINDOW
+from vquest.__main__ import main
+from .test_vquest import TestVquestBase
+
+
+class TestPlan(TestVquestBase):
+    """Test plan() and the --plan command-line option."""
+
+    def test_plan(self):
+        """Test that a plan is made without sending anything."""
+        summary = plan(self.config)
+        self.assertEqual(self.post.call_count, 0)
+        self.assertEqual(summary["sequences"], 1)
+        self.assertEqual(summary["unique_sequences"], 1)
+        self.assertEqual(summary["requests"], 1)
+        self.assertGreater(summary["payload_bytes"], 322)
+        self.assertEqual(summary["latency"], LATENCY)
+        self.assertEqual(summary["seconds"], LATENCY)
+
+    def test_plan_duplicates(self):
+        """Test a plan for more than one batch, with duplicate sequences."""
+        self.config["sequences"] = "".join(
+            ">seq%d\nACGT%s\n" % (idx, "A" * (idx % 10)) for idx in range(120))
+        summary = plan(self.config, latency=5)
+        self.assertEqual(summary["sequences"], 120)
+        self.assertEqual(summary["unique_sequences"], 10)
+        self.assertEqual(summary["requests"], 3)
+        self.assertEqual(summary["seconds"], 17)
+
+    def test_plan_ids(self):
+        """Test a plan for just some sequences."""
+        self.config["sequences"] = "".join(
+            ">seq%d\nACGT%s\n" % (idx, "A" * idx) for idx in range(120))
+        summary = plan(self.config, latency=5, ids=["seq1", "seq2", "seq200"])
+        self.assertEqual(summary["sequences"], 2)
+        self.assertEqual(summary["requests"], 1)
+
+    def test_plan_server(self):
+        """Test a plan for sending everything via a coalescing server."""
+        self.config["sequences"] = "".join(
+            ">seq%d\nACGT%s\n" % (idx, "A" * idx) for idx in range(120))
+        summary = plan(self.config, latency=5, server="http://localhost:8850")
+        self.assertEqual(self.post.call_count, 0)
+        self.assertEqual(summary["requests"], 1)
+        self.assertEqual(summary["seconds"], 17 + WINDOW)
+
+    def test_plan_main(self):
+        """Test --plan, using timings from a previous profile."""
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as tempdir:
+            os.chdir(tempdir)
+            with open("vquest_profile.txt", "wt") as f_out:
+                f_out.write(
+                    "stage\tcalls\twall_s\tcpu_s\twait_s\tpeak_mib\tretained_mib\n"
+                    "post\t2\t30.000\t0.010\t29.990\t0.10\t0.00\n")
+            with redirect_stdout(out):
+                main([str(self.path / "config.yml"), "--plan"])
+            self.assertEqual(os.listdir("."), ["vquest_profile.txt"])
+        self.assertEqual(self.post.call_count, 0)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], "Sequences: 1 (1 unique)")
+        self.assertEqual(lines[1], "Requests: 1")
+        self.assertEqual(lines[3], "Projected time: 15 s (15.0 s per request, from past timings)")
@@ -0,0 +1,71 @@
+"""
+Test profiling of vquest stages.
+"""
+
+import os
+import pstats
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from vquest import profiling
+from vquest.__main__ import main
+from .test_vquest import TestVquestBase
+
+
+class TestProfiler(unittest.TestCase):
+    """Basic test of Profiler."""
+
+    def test_profiler(self):
+        """Test that stages are only recorded while profiling."""
+        with profiling.stage("ignored"):
+            pass
+        with profiling.Profiler() as prof:
+            for _ in range(2):
+                with profiling.stage("example"):
+                    data = [0] * 100000
+        del data
+        with profiling.stage("ignored"):
+            pass
+        self.assertEqual(list(prof.stages), ["example"])
+        self.assertEqual(prof.stages["example"].calls, 2)
+        self.assertGreater(prof.stages["example"].peak, 0)
+        lines = prof.report().splitlines()
+        self.assertEqual(
+            lines[0], "stage\tcalls\twall_s\tcpu_s\twait_s\tpeak_mib\tretained_mib")
+        self.assertTrue(lines[1].startswith("example\t2\t"))
+
+    def test_profiled(self):
+        """Test that functions run on other threads are included in the stats."""
+        def work_in_thread():
+            return sum(range(1000))
+        with profiling.Profiler() as prof:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(profiling.profiled(work_in_thread)).result()
+        with tempfile.TemporaryDirectory() as tempdir:
+            prof.write(Path(tempdir) / "profile")
+            stats = pstats.Stats(str(Path(tempdir) / "profile.pstats"))
+        self.assertIn(
+            "work_in_thread",
+            [func[2] for func in stats.stats]) # pylint: disable=no-member
+
+
+class TestProfileMain(TestVquestBase):
+    """Test the command-line interface with --profile."""
+
+    def test_vquest_main(self):
+        """Test that a report and pstats file are written with the usual output."""
+        with tempfile.TemporaryDirectory() as tempdir:
+            os.chdir(tempdir)
+            main([str(self.path / "config.yml"), "--profile"])
+            self.assertTrue(Path("vquest_airr.tsv").exists())
+            with open("vquest_profile.txt") as f_in:
+                stages = [line.split("\t")[0] for line in f_in]
+            self.assertEqual(stages[0], "stage")
+            self.assertEqual(
+                sorted(stages[1:]),
+                ["check", "collapse", "delay", "parse", "post", "serialize", "unzip", "write"])
+            stats = pstats.Stats("vquest_profile.pstats")
+            # The (mock) POST request itself is profiled too
+            self.assertTrue(any(
+                "_mock_call" in func[2] for func in stats.stats)) # pylint: disable=no-member
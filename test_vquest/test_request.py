@@ -0,0 +1,105 @@
+"""
+Test request pacing, deadlines, and hedging.
+"""
+
+import time
+import threading
+import unittest
+from contextlib import redirect_stderr
+from io import StringIO
+import requests
+from unittest.mock import patch, Mock
+from vquest.request import Pacer
+from vquest.__main__ import main
+from vquest.util import VquestError
+
+
+class TestPacer(unittest.TestCase):
+    """Test Pacer with a fake POST function that can be made to stall."""
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.responses = []
+        self.threads = []
+        patcher = patch("vquest.request.requests.post", side_effect=self.fake_post)
+        self.post = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.release.set)
+
+    def fake_post(self, *args, **kwargs):
+        """Stall on the first request until released; answer others immediately."""
+        self.threads.append(threading.current_thread())
+        response = Mock(name="response%d" % len(self.responses))
+        self.responses.append(response)
+        if len(self.responses) == 1 and not self.release.wait(kwargs.get("timeout")):
+            raise requests.exceptions.Timeout()
+        return response
+
+    def test_post(self):
+        """Test that a request is sent with a timeout matching the deadline."""
+        self.release.set()
+        pacer = Pacer(delay=0, deadline=5)
+        response = pacer.post("url", data={"key": "val"})
+        self.assertIs(response, self.responses[0])
+        self.assertEqual(self.post.call_args.kwargs, {"data": {"key": "val"}, "timeout": 5})
+        self.assertEqual(len(pacer.times), 1)
+        # Without hedging, the request is sent from the calling thread
+        self.assertIs(self.threads[0], threading.current_thread())
+
+    def test_deadline(self):
+        """Test that a stalled request gives up at the deadline."""
+        pacer = Pacer(delay=0, deadline=0.1)
+        with self.assertRaises(VquestError):
+            pacer.post("url")
+
+    def test_hedge(self):
+        """Test that a stalled request is hedged and the faster response used."""
+        pacer = Pacer(delay=0.2, deadline=5, hedge=50)
+        pacer.times.extend([0.01] * 5)
+        start = time.monotonic()
+        response = pacer.post("url")
+        elapsed = time.monotonic() - start
+        self.assertEqual(self.post.call_count, 2)
+        self.assertIs(response, self.responses[1])
+        # The hedged request still had to wait out the usual delay
+        self.assertGreaterEqual(elapsed, 0.2)
+        self.assertLess(elapsed, 5)
+
+    def test_wait(self):
+        """Test that the delay is counted from when the last response arrived."""
+        pacer = Pacer(delay=0.2, deadline=5)
+        def release():
+            time.sleep(0.3)
+            self.release.set()
+        threading.Thread(target=release).start()
+        pacer.wait()
+        pacer.post("url")
+        start = time.monotonic()
+        pacer.wait()
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+    def test_wait_after_hedge(self):
+        """Test that a hedged request adds its own delay before the next one."""
+        pacer = Pacer(delay=0.2, deadline=5, hedge=50)
+        pacer.times.extend([0.01] * 5)
+        pacer.post("url")
+        start = time.monotonic()
+        pacer.wait()
+        self.assertGreaterEqual(time.monotonic() - start, 0.35)
+
+    def test_hedge_percentile(self):
+        """Test that the hedging percentile must be from 0 to 100."""
+        for hedge in (-1, 150):
+            with self.assertRaises(ValueError):
+                Pacer(hedge=hedge)
+        with redirect_stderr(StringIO()), self.assertRaises(SystemExit):
+            main(["--hedge", "150"])
+        self.assertEqual(self.post.call_count, 0)
+
+    def test_no_hedge_without_history(self):
+        """Test that nothing is hedged until there are enough recent times."""
+        pacer = Pacer(delay=0, deadline=0.2, hedge=50)
+        pacer.times.extend([0.01] * 4)
+        with self.assertRaises(VquestError):
+            pacer.post("url")
+        self.assertEqual(self.post.call_count, 1)
@@ -0,0 +1,81 @@
+"""
+Test VquestResult.
+"""
+
+import tempfile
+import unittest
+from pathlib import Path
+from vquest.result import VquestResult
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+CHUNKS = [
+    {
+        "Parameters.txt": b"Date\tToday\n",
+        "vquest_airr.tsv": b"sequence_id\tlocus\tv_call\nseq1\tIGH\tIGHV4-1\nseq2\tIGK\tIGKV1-2\n"},
+    {
+        "Parameters.txt": b"Date\tToday\n",
+        "vquest_airr.tsv": b"sequence_id\tlocus\tv_call\nseq3\tIGH\tIGHV3-5"}]
+
+
+class TestVquestResult(unittest.TestCase):
+    """Basic test of VquestResult with in-memory batches."""
+
+    def setUp(self):
+        self.result = VquestResult(CHUNKS)
+
+    def test_mapping(self):
+        """Test that a VquestResult acts like a dictionary of file contents."""
+        self.assertEqual(list(self.result.keys()), ["Parameters.txt", "vquest_airr.tsv"])
+        self.assertEqual(self.result["Parameters.txt"], "Date\tToday\n")
+        self.assertEqual(
+            self.result["vquest_airr.tsv"],
+            "sequence_id\tlocus\tv_call\n"
+            "seq1\tIGH\tIGHV4-1\n"
+            "seq2\tIGK\tIGKV1-2\n"
+            "seq3\tIGH\tIGHV3-5\n")
+        with self.assertRaises(KeyError):
+            self.result["other.txt"] # pylint: disable=pointless-statement
+
+    def test_rows(self):
+        """Test iterating over AIRR rows."""
+        rows = list(self.result.rows())
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1].sequence_id, "seq2")
+        self.assertEqual(tuple(rows[2]), ("seq3", "IGH", "IGHV3-5"))
+
+    def test_column(self):
+        """Test getting a single AIRR column."""
+        self.assertEqual(self.result.column("locus"), ["IGH", "IGK", "IGH"])
+
+    @unittest.skipUnless(pandas, "pandas not available")
+    def test_to_dataframe(self):
+        """Test loading AIRR rows into a DataFrame."""
+        frame = self.result.to_dataframe()
+        self.assertEqual(list(frame["sequence_id"]), ["seq1", "seq2", "seq3"])
+
+
+class TestVquestResultFromDir(TestVquestResult):
+    """Test VquestResult with batches loaded from files on disk."""
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        for idx, chunk in enumerate(CHUNKS):
+            chunkdir = Path(self.tempdir.name) / str(idx + 1).zfill(3)
+            chunkdir.mkdir()
+            for key, val in chunk.items():
+                (chunkdir / key).write_bytes(val)
+        self.result = VquestResult.from_dir(self.tempdir.name)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+
+class TestVquestResultEmptyBatch(TestVquestResult):
+    """Test VquestResult with an empty batch first (as for a resubmitted one)."""
+
+    def setUp(self):
+        self.result = VquestResult([{"vquest_airr.tsv": b""}] + CHUNKS)
@@ -0,0 +1,176 @@
+"""
+Tests for the coalescing server.
+
+These use the same mock POST request setup as the main vquest tests, so
+nothing gets sent to IMGT.
+"""
+
+import sys
+import time
+import threading
+from io import BytesIO, StringIO
+from zipfile import ZipFile
+from unittest.mock import DEFAULT, patch
+from Bio import SeqIO
+from vquest import request
+from vquest import server
+from vquest.request import vquest
+from vquest.util import VquestError
+from .test_vquest import TestVquestBase
+
+
+class TestCoalescer(TestVquestBase):
+    """Test grouping sequences from separate submissions into chunks."""
+
+    def setUp(self):
+        super().setUp()
+        self.delay = request.DELAY
+        request.DELAY = 0
+        self.records = list(SeqIO.parse(StringIO(self.config["sequences"]), "fasta"))
+        with open(self.path / "expected/Parameters.txt") as f_in:
+            self.parameters = f_in.read()
+        with open(self.path / "expected/vquest_airr.tsv") as f_in:
+            self.airr = f_in.read()
+
+    def tearDown(self):
+        request.DELAY = self.delay
+        super().tearDown()
+
+    def set_response(self, airr):
+        """Make the mock POST return a zip file with the given AIRR text."""
+        with BytesIO() as f_out:
+            with ZipFile(f_out, "w") as zipobj:
+                zipobj.writestr("Parameters.txt", self.parameters)
+                zipobj.writestr("vquest_airr.tsv", airr)
+            self.post.return_value.content = f_out.getvalue()
+
+    def submit_all(self, coalescer, submissions):
+        """Submit each list of records from its own thread and gather outputs."""
+        outputs = [None] * len(submissions)
+        def submit(idx):
+            outputs[idx] = coalescer.submit(self.config, submissions[idx])
+        threads = [
+            threading.Thread(target=submit, args=(idx,)) for idx in range(len(submissions))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outputs
+
+    def test_coalesce(self):
+        """Test that separate submissions are sent as one request."""
+        header, row = self.airr.splitlines(keepends=True)
+        record2 = self.records[0][:]
+        record2.id = "seq2"
+        row2 = row.replace(self.records[0].id, record2.id)
+        self.set_response(header + row + row2)
+        coalescer = server.Coalescer(window=1)
+        outputs = self.submit_all(coalescer, [self.records, [record2]])
+        self.assertEqual(self.post.call_count, 1)
+        self.assertEqual(outputs[0]["vquest_airr.tsv"].decode(), header + row)
+        self.assertEqual(outputs[1]["vquest_airr.tsv"].decode(), header + row2)
+        self.assertEqual(outputs[1]["Parameters.txt"].decode(), self.parameters)
+
+    def test_coalesce_same_ids(self):
+        """Test that the same sequence ID from separate submissions is kept apart.
+
+        The rows from the results couldn't be matched up with the right
+        submission otherwise, so they should be sent in separate requests.
+        """
+        coalescer = server.Coalescer(window=1)
+        outputs = self.submit_all(coalescer, [self.records, self.records])
+        self.assertEqual(self.post.call_count, 2)
+        for output in outputs:
+            self.assertEqual(output["vquest_airr.tsv"].decode(), self.airr)
+
+    def test_coalesce_last_column(self):
+        """Test routing rows when sequence_id is the last column."""
+        airr = "locus\tsequence_id\nIGK\t%s\n" % self.records[0].id
+        self.set_response(airr)
+        coalescer = server.Coalescer(window=0)
+        output = coalescer.submit(self.config, self.records)
+        self.assertEqual(output["vquest_airr.tsv"].decode(), airr)
+
+    def test_coalesce_bad_output(self):
+        """Test that unusable output is an error for the client, not the worker.
+
+        The worker thread should carry on handling later submissions.
+        """
+        self.set_response(self.airr.replace("sequence_id", "something_else"))
+        coalescer = server.Coalescer(window=0)
+        with self.assertRaises(ValueError):
+            coalescer.submit(self.config, self.records)
+        self.set_response(self.airr)
+        output = coalescer.submit(self.config, self.records)
+        self.assertEqual(output["vquest_airr.tsv"].decode(), self.airr)
+
+    def test_coalesce_deadline(self):
+        """Test that a submission gives up if its results never arrive."""
+        release = threading.Event()
+        self.addCleanup(release.set)
+        coalescer = server.Coalescer(window=0, deadline=0.2)
+        with patch("vquest.request._submit_chunk", side_effect=lambda *args: release.wait()):
+            with self.assertRaises(VquestError):
+                coalescer.submit(self.config, self.records)
+
+    def test_coalesce_disconnect(self):
+        """Test that a disconnected client's unsent records are withdrawn."""
+        release = threading.Event()
+        self.addCleanup(release.set)
+        coalescer = server.Coalescer(window=0, chunk_size=1)
+        with patch("vquest.request._submit_chunk", side_effect=lambda *args: release.wait()):
+            with self.assertRaises(ConnectionError):
+                coalescer.submit(self.config, self.records, connected=lambda: False)
+            # The first chunk was already sent, but nothing else is left to send
+            time.sleep(0.1)
+            self.assertEqual(coalescer._pending, {})
+
+
+class TestServer(TestVquestBase):
+    """Test vquest() as a client of a coalescing server over HTTP."""
+
+    def setUp(self):
+        super().setUp()
+        self.delay = request.DELAY
+        request.DELAY = 0
+        self.httpd = server.make_server("localhost", 0, window=0)
+        self.url = "http://%s:%d" % self.httpd.server_address[:2]
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        # Only the server's own request to V-QUEST should get the mock
+        # response; the client's request to the server is passed through.
+        post_real = sys.modules["requests"].post_real
+        def post_local(url, **kwargs):
+            if url == self.url:
+                return post_real(url, **kwargs)
+            return DEFAULT
+        self.post.side_effect = post_local
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        request.DELAY = self.delay
+        super().tearDown()
+
+    def test_vquest(self):
+        """Test that a request via the server gives the expected response."""
+        result = vquest(self.config, server=self.url)
+        self.assertEqual(self.post.call_count, 2)
+        limit = server.submit_limit(request.DEADLINE, 1)
+        self.assertEqual(self.post.call_args_list[0].kwargs["json"]["limit"], limit)
+        self.assertEqual(self.post.call_args_list[0].kwargs["timeout"], limit + server.GRACE)
+        self.assertEqual(self.post.call_args.args, (request.URL, ))
+        with open(self.path / "expected/Parameters.txt") as f_in:
+            parameters = f_in.read()
+        with open(self.path / "expected/vquest_airr.tsv") as f_in:
+            vquest_airr = f_in.read()
+        self.assertEqual(parameters, result["Parameters.txt"])
+        self.assertEqual(vquest_airr, result["vquest_airr.tsv"])
+
+    def test_bad_submission(self):
+        """Test that a malformed submission gets a 400 error in JSON."""
+        post_real = sys.modules["requests"].post_real
+        response = post_real(self.url, data=b"not json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", response.json())
+        response = post_real(self.url, json={"sequences": ">seq\nACGT\n"})
+        self.assertEqual(response.status_code, 400)
@@ -18,12 +18,22 @@ import unittest
 from unittest.mock import Mock, DEFAULT
 from contextlib import redirect_stdout, redirect_stderr
 from pathlib import Path
-from io import StringIO
+from io import StringIO, BytesIO
+from zipfile import ZipFile
 import yaml
+from vquest import request
 from vquest.request import vquest
 from vquest.util import VquestError
 from vquest.__main__ import main
 
+def make_zip(files):
+    """Make zip file bytes from a dictionary of file names to bytes."""
+    with BytesIO() as f_out:
+        with ZipFile(f_out, "w") as zipobj:
+            for name, data in files.items():
+                zipobj.writestr(name, data)
+        return f_out.getvalue()
+
 # If True, a mock post request function is still set up, but it also acts as a
 # wrapper for real POST requests over the network and saves the real response
 # data from IMGT in the test data directory.
@@ -127,7 +137,7 @@ CC
 """
         self.assertEqual(
             self.post.call_args.kwargs,
-            {"data": config_used})
+            {"data": config_used, "timeout": request.DEADLINE})
         self.assertEqual(
             list(result.keys()),
             ["Parameters.txt", "vquest_airr.tsv"])
@@ -268,7 +278,7 @@ CC
 """
         self.assertEqual(
             self.post.call_args.kwargs,
-            {"data": config_used})
+            {"data": config_used, "timeout": request.DEADLINE})
         self.assertEqual(
             list(result.keys()),
             ["Parameters.txt", "vquest_airr.tsv"])
@@ -365,6 +375,131 @@ class TestVquestCustom(TestVquestSimple):
             self.assertTrue(Path("Parameters.txt").exists())
 
 
+class TestVquestFileTransport(TestVquestBase):
+    """Test sending sequences as a file upload rather than inline text."""
+
+    def test_vquest(self):
+        """Test that a file upload request gives the expected response."""
+        result = vquest(self.config, transport="file")
+        self.assertEqual(self.post.call_count, 1)
+        self.assertEqual(
+            self.post.call_args.args,
+            ('https://www.imgt.org/IMGT_vquest/analysis', ))
+        config_used = self.config.copy()
+        del config_used["sequences"]
+        config_used["inputType"] = "file"
+        self.assertEqual(
+            self.post.call_args.kwargs,
+            {"data": config_used, "timeout": request.DEADLINE, "files": {"fileSequences": (
+                "sequences.fasta",
+                b">IGKV2-ACR*02\n"
+                b"GACATTGTGATGACCCAGACTCCACTCTCCCTGCCCGTCACCCCTGGAGAGCCAGCCTCC"
+                b"ATCTCCTGCAGGTCTAGTCAGAGCCTCTTGGATAGTGACGGGTACACCTGTTTGGACTGG"
+                b"TACCTGCAGAAGCCAGGCCAGTCTCCACAGCTCCTGATCTATGAGGTTTCCAACCGGGTC"
+                b"TCTGGAGTCCCTGACAGGTTCAGTGGCAGTGGGTCAGNCACTGATTTCACACTGAAAATC"
+                b"AGCCGGGTGGAAGCTGAGGATGTTGGGGTGTATTACTGTATGCAAAGTATAGAGTTTCCT"
+                b"CC\n",
+                "text/plain")}})
+        with open(self.path / "expected/vquest_airr.tsv") as f_in:
+            vquest_airr = f_in.read()
+        self.assertEqual(vquest_airr, result["vquest_airr.tsv"])
+
+    def test_vquest_main(self):
+        """Test the command-line interface with --transport file."""
+        with tempfile.TemporaryDirectory() as tempdir:
+            os.chdir(tempdir)
+            main(["--transport", "file", str(self.path / "config.yml")])
+            self.assertEqual(self.post.call_args.kwargs["data"]["inputType"], "file")
+            self.assertTrue(Path("vquest_airr.tsv").exists())
+            self.assertTrue(Path("Parameters.txt").exists())
+
+
+class TestVquestMissing(TestVquestBase):
+    """Test vquest when a sequence is missing from the results.
+
+    Just the missing sequence should be resubmitted, up to the retry limit,
+    and then reported if it's still missing.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.delay = request.DELAY
+        request.DELAY = 0
+
+    def tearDown(self):
+        request.DELAY = self.delay
+        super().tearDown()
+
+    def test_vquest(self):
+        """Test that missing sequences are resubmitted and reported."""
+        with self.assertLogs("vquest.request", level="WARNING") as log_cm:
+            result = vquest(self.config, retries=2)
+        self.assertEqual(self.post.call_count, 3)
+        self.assertEqual(
+            self.post.call_args.kwargs["data"]["sequences"],
+            ">missing\nGACATTGTGATGACCCAGACTCCACTCTCCCTGCCCGTCACCCCTGGAGAGCCAGCCTCC\n")
+        self.assertEqual(
+            log_cm.output[-1],
+            "WARNING:vquest.request:1 sequences still missing from results "
+            "after 2 retries: missing")
+        self.assertEqual(result.missing, ["missing"])
+        with open(self.path / "expected/vquest_airr.tsv") as f_in:
+            vquest_airr = f_in.read()
+        # The one row that did come through is still there (three times
+        # over, since the mock response always includes it)
+        self.assertEqual(
+            result["vquest_airr.tsv"].splitlines()[:2],
+            vquest_airr.splitlines())
+
+    def test_vquest_empty_airr(self):
+        """Test that an empty AIRR table counts all sequences as missing."""
+        self.post.return_value.content = make_zip({
+            "Parameters.txt": b"", "vquest_airr.tsv": b""})
+        with self.assertLogs("vquest.request", level="WARNING"):
+            result = vquest(self.config, retries=1)
+        self.assertEqual(self.post.call_count, 2)
+        self.assertEqual(result.missing, ["IGKV2-ACR*02", "missing"])
+
+    def test_vquest_empty_airr_retry(self):
+        """Test that an empty AIRR table followed by a good one keeps the header."""
+        good = self.post.return_value.content
+        contents = [make_zip({"Parameters.txt": b"", "vquest_airr.tsv": b""}), good]
+        def post(*args, **kwargs):
+            self.post.return_value.content = contents.pop(0) if contents else good
+            return DEFAULT
+        self.post.side_effect = post
+        with self.assertLogs("vquest.request", level="WARNING"):
+            result = vquest(self.config, retries=1)
+        self.assertEqual(self.post.call_count, 2)
+        with open(self.path / "expected/vquest_airr.tsv") as f_in:
+            header = f_in.readline()
+        self.assertEqual(result["vquest_airr.tsv"].splitlines(keepends=True)[0], header)
+        self.assertEqual(result.header[0], "sequence_id")
+        self.assertEqual(result.column("sequence_id"), ["IGKV2-ACR*02"])
+        self.assertEqual(len(list(result.rows())), 1)
+        self.assertEqual(result.missing, ["missing"])
+
+    def test_vquest_deadline(self):
+        """Test that a chunk that runs past its deadline is resubmitted."""
+        responses = [sys.modules["requests"].exceptions.Timeout()]
+        def post(*args, **kwargs):
+            if responses:
+                raise responses.pop(0)
+            return DEFAULT
+        self.post.side_effect = post
+        with self.assertLogs("vquest.request", level="WARNING"):
+            result = vquest(self.config, retries=1)
+        self.assertEqual(self.post.call_count, 2)
+        self.assertEqual(result.column("sequence_id"), ["IGKV2-ACR*02"])
+        self.assertEqual(result.missing, ["missing"])
+
+    def test_vquest_no_retries(self):
+        """Test that nothing is resubmitted with retries=0."""
+        with self.assertLogs("vquest.request", level="WARNING"):
+            vquest(self.config, retries=0)
+        self.assertEqual(self.post.call_count, 1)
+
+
 class TestVquestInvalid(TestVquestBase):
     """Test vquest for an invalid request.
 
@@ -9,6 +9,10 @@ from pathlib import Path
 from vquest import __doc__ as main_doc
 from vquest import LOGGER
 from vquest import vq
+from vquest import server
+from vquest.partition import PartitionWriter, check_columns
+from vquest.profiling import Profiler, stage, read_report
+from vquest.plan import plan
 
 def main(arglist=None):
     """Command-line interface for V-QUEST requests"""
@@ -19,11 +23,68 @@ def main(arglist=None):
     else:
         args = parser.parse_args(arglist)
     LOGGER.setLevel(max(10, logging.WARNING - 10*args.verbose))
+    if args.serve:
+        server.serve(
+            args.host, args.port, args.window, args.transport, args.deadline, args.hedge)
+        return
+    if args.hedge is not None and not 0 <= args.hedge <= 100:
+        parser.error(f"--hedge must be a percentile from 0 to 100, not {args.hedge}")
+    if args.partition:
+        try:
+            check_columns(args.partition)
+        except ValueError as err:
+            parser.error(str(err))
     config_full = __setup_config(args, parser)
-    output = vq.vquest(config_full, collapse=args.collapse)
-    __process_output(args, output)
+    if args.plan:
+        __plan(args, config_full)
+    elif args.profile:
+        with Profiler() as prof:
+            __run(args, config_full)
+        args.outdir.mkdir(parents=True, exist_ok=True)
+        prof.write(args.outdir / "vquest_profile")
+        LOGGER.info("Profile by stage:\n%s", prof.report())
+    else:
+        __run(args, config_full)
     LOGGER.info("Done.")
 
+def __plan(args, config_full):
+    # Use the request times from a previous profiled run, if there is one
+    latency = None
+    profile_path = args.outdir / "vquest_profile.txt"
+    if profile_path.exists():
+        post = read_report(profile_path).get("post")
+        if post and post["calls"]:
+            latency = post["wall_s"] / post["calls"]
+            LOGGER.info("Using request times from %s", profile_path)
+    summary = plan(
+        config_full, transport=args.transport, latency=latency,
+        ids=args.ids, index=args.index, server=args.server, start_chunk=args.start_chunk)
+    print("Sequences: %d (%d unique)" % (summary["sequences"], summary["unique_sequences"]))
+    print("Requests: %d" % summary["requests"])
+    print("Payload: %d bytes" % summary["payload_bytes"])
+    print("Projected time: %.0f s (%.1f s per request%s)" % (
+        summary["seconds"], summary["latency"],
+        ", from past timings" if latency is not None else ", estimated"))
+
+def __run(args, config_full):
+    vquest_args = {
+        "collapse": args.collapse,
+        "server": args.server,
+        "transport": args.transport,
+        "retries": args.retries,
+        "deadline": args.deadline,
+        "hedge": args.hedge,
+        "ids": args.ids,
+        "index": args.index,
+        "start_chunk": args.start_chunk}
+    if args.partition:
+        args.outdir.mkdir(parents=True, exist_ok=True)
+        with PartitionWriter(args.outdir, args.partition) as writer:
+            output = vq.vquest(config_full, on_chunk=writer.add, **vquest_args)
+    else:
+        output = vq.vquest(config_full, **vquest_args)
+    __process_output(args, output)
+
 def __setup_config(args, parser):
     args_set = {k: v for k, v in vars(args).items() if v is not None}
     # All the possible vquest options.  They're grouped by section as the keys
@@ -60,23 +121,30 @@ def __setup_config(args, parser):
 def __process_output(args, output):
     if args.align:
         LOGGER.info("Writing FASTA to stdout")
-        print(vq.airr_to_fasta(output["vquest_airr.tsv"]), end="")
+        fasta = vq.airr_to_fasta(output["vquest_airr.tsv"])
+        with stage("write"):
+            print(fasta, end="")
     else:
         args.outdir.mkdir(parents=True, exist_ok=True)
         if args.collapse:
             for key in output:
+                if args.partition and key == "vquest_airr.tsv":
+                    continue
                 output_path = args.outdir / key
                 LOGGER.info("Writing %s", output_path)
-                with open(output_path, "wt") as f_out:
-                    f_out.write(output[key])
+                text = output[key]
+                with stage("write"), open(output_path, "wt") as f_out:
+                    f_out.write(text)
         else:
             for idx, chunk in enumerate(output):
                 chunkdir = str(idx + 1).zfill(3)
                 (args.outdir / chunkdir).mkdir(parents=True, exist_ok=True)
                 for key in chunk:
+                    if args.partition and key == "vquest_airr.tsv":
+                        continue
                     output_path = args.outdir / chunkdir / key
                     LOGGER.info("Writing %s", output_path)
-                    with open(output_path, "wb") as f_out:
+                    with stage("write"), open(output_path, "wb") as f_out:
                         f_out.write(chunk[key])
 
 def __setup_arg_parser():
@@ -105,6 +173,73 @@ def __setup_arg_parser():
             "from AIRR results and print as FASTA.  "
             "If there is no text in the sequence_alignment column "
             "for a given sequence the original sequence is used instead."))
+    parser.add_argument(
+        "--transport", default="inline", choices=vq.TRANSPORTS,
+        help=("how to send each batch of sequences to V-QUEST: as form text "
+            "(inline, the default) or as a file upload (file)"))
+    parser.add_argument(
+        "--plan", action="store_true",
+        help=("Instead of submitting sequences, report how many requests would "
+            "be sent, their total size, and how long they would take.  If "
+            "vquest_profile.txt from a previous --profile run is in the "
+            "output directory, its request times are used for the estimate."))
+    parser.add_argument(
+        "--profile", action="store_true",
+        help=("profile time and memory usage for each stage of the run, and "
+            "write a summary to vquest_profile.txt and cProfile statistics to "
+            "vquest_profile.pstats in the output directory"))
+    parser.add_argument(
+        "--partition", nargs="+", metavar="COLUMN",
+        help=("write AIRR results split into files by the values of these "
+            "columns (e.g. locus v_family) rather than a single "
+            "vquest_airr.tsv, plus a manifest.tsv of row counts per file.  "
+            "v_family, d_family, and j_family give gene families from the "
+            "corresponding _call columns."))
+    parser.add_argument(
+        "--retries", default=vq.RETRIES, type=int,
+        help=("how many times to resubmit sequences missing from a batch's "
+            "results (%d by default)" % vq.RETRIES))
+    parser.add_argument(
+        "--ids", nargs="+", metavar="ID",
+        help=("submit only the sequences with these IDs.  For fileSequences, "
+            "these are read directly via an index of the file (see --index)."))
+    parser.add_argument(
+        "--index", action="store_true",
+        help=("read fileSequences via an index of record positions, saved "
+            "alongside the file (as .vqi) and reused in later runs, one "
+            "batch at a time rather than all at once"))
+    parser.add_argument(
+        "--start-chunk", default=0, type=int, metavar="N",
+        help=("skip the first N batches of %d sequences, such as to resume "
+            "an interrupted run" % vq.CHUNK_SIZE))
+    parser.add_argument(
+        "--deadline", default=vq.DEADLINE, type=float,
+        help=("seconds to wait for the results of any one batch (%d by "
+            "default; 0 for no limit) before counting its sequences as "
+            "missing, to be resubmitted (see --retries)" % vq.DEADLINE))
+    parser.add_argument(
+        "--hedge", type=float, metavar="PERCENTILE",
+        help=("if a batch takes longer than this percentile of recent batches' "
+            "times (e.g. 95), send it again and use whichever response "
+            "arrives first"))
+    parser.add_argument(
+        "--server", help=("URL of a running \"vquest --serve\" instance "
+            "to submit sequences through rather than directly to V-QUEST"))
+    parser.add_argument(
+        "--serve", action="store_true",
+        help=("Instead of submitting sequences, run a local server that accepts "
+            "sequences from other vquest clients (see --server) and batches them "
+            "together into full-sized requests to V-QUEST"))
+    parser.add_argument(
+        "--host", default=server.HOST,
+        help="host name for --serve to listen on (%s by default)" % server.HOST)
+    parser.add_argument(
+        "--port", default=server.PORT, type=int,
+        help="port for --serve to listen on (%d by default)" % server.PORT)
+    parser.add_argument(
+        "--window", default=server.WINDOW, type=float,
+        help=("seconds for --serve to wait for more sequences before sending "
+            "a partly-filled batch (%s by default)" % server.WINDOW))
     for opt_section in vq.OPTIONS:
         option_parser = parser.add_argument_group(
             title="V-QUEST options: \"%s\" section" % opt_section["section"],
@@ -0,0 +1,193 @@
+"""
+Persistent index of record positions in FASTA and FASTQ files.
+
+The index is kept in a sidecar file next to the sequence file (seqs.fastq.vqi
+for seqs.fastq), much like a .fai index, with one line per record:
+
+    #vquest-index	<file size>	<file modification time>	<format>	<record count>
+    <sequence ID>	<byte offset>	<byte length>
+    ...
+
+It's rebuilt automatically if the sequence file's size or modification time
+no longer match, or if the index itself is incomplete, and otherwise reused
+across runs.  It's written to a temporary file first and then moved into
+place, so an interrupted run never leaves a partial index behind.
+"""
+
+import os
+import mmap
+import logging
+from array import array
+from io import StringIO
+from pathlib import Path
+from Bio import SeqIO
+
+LOGGER = logging.getLogger(__name__)
+
+SUFFIX = ".vqi"
+MAGIC = "#vquest-index"
+
+
+class SequenceIndex:
+    """Byte offsets and IDs of each record in a FASTA or FASTQ file.
+
+    Records can be read by position (records(), chunk()) or by ID (get())
+    straight from a memory map of the file, without parsing anything else in
+    it.  FASTQ files must have the usual four lines per record.
+    """
+
+    def __init__(self, path, fmt, ids, offsets, lengths):
+        self.path = Path(path)
+        self.fmt = fmt
+        self.ids = ids
+        self.offsets = offsets
+        self.lengths = lengths
+        self._positions = None
+
+    @classmethod
+    def load(cls, path, fmt):
+        """Load the sidecar index for a file, building it first if needed.
+
+        If the saved index can't be read or is damaged, it's rebuilt, and if
+        the index can't be saved (such as in a read-only directory), it's
+        still used for this run.
+        """
+        path = Path(path)
+        index_path = path.parent / (path.name + SUFFIX)
+        stat = path.stat()
+        stamp = [MAGIC, str(stat.st_size), str(stat.st_mtime_ns), fmt]
+        if index_path.exists():
+            try:
+                index = cls.__read(path, fmt, index_path, stamp)
+                if index is not None:
+                    LOGGER.info("Using index %s", index_path)
+                    return index
+            except (OSError, ValueError) as err:
+                LOGGER.warning("Couldn't read index %s (%s); rebuilding it", index_path, err)
+        index = cls.build(path, fmt)
+        LOGGER.info("Writing index %s", index_path)
+        index.__write(index_path, stamp)
+        return index
+
+    @classmethod
+    def __read(cls, path, fmt, index_path, stamp):
+        """Read a saved index, or give None if it's out of date."""
+        with open(index_path) as f_in:
+            header = f_in.readline().rstrip("\n").split("\t")
+            if header[:-1] != stamp:
+                return None
+            ids = []
+            offsets = array("Q")
+            lengths = array("Q")
+            for line in f_in:
+                seqid, offset, length = line.rstrip("\n").split("\t")
+                ids.append(seqid)
+                offsets.append(int(offset))
+                lengths.append(int(length))
+        if len(ids) != int(header[-1]):
+            raise ValueError(f"expected {header[-1]} records but found {len(ids)}")
+        return cls(path, fmt, ids, offsets, lengths)
+
+    def __write(self, index_path, stamp):
+        # Each process writes its own temporary file, so concurrent runs
+        # can't interleave their output
+        tmp_path = index_path.parent / f"{index_path.name}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wt") as f_out:
+                f_out.write("\t".join(stamp + [str(len(self))]) + "\n")
+                for seqid, offset, length in zip(self.ids, self.offsets, self.lengths):
+                    f_out.write(f"{seqid}\t{offset}\t{length}\n")
+            os.replace(tmp_path, index_path)
+        except OSError as err:
+            LOGGER.warning("Couldn't save index %s: %s", index_path, err)
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+
+    @classmethod
+    def build(cls, path, fmt):
+        """Scan a file for record positions (without saving an index)."""
+        LOGGER.info("Indexing %s", path)
+        ids = []
+        offsets = array("Q")
+        with open(path, "rb") as f_in:
+            offset = 0
+            lineno = 0
+            for line in f_in:
+                if fmt == "fasta":
+                    start = line.startswith(b">")
+                elif fmt == "fastq":
+                    start = lineno % 4 == 0
+                    if lineno % 4 == 2 and not line.startswith(b"+"):
+                        raise ValueError(
+                            f"Can't index {path}: only four-line FASTQ records are supported")
+                else:
+                    raise ValueError(f"Can't index {fmt} format")
+                if start and line.strip():
+                    fields = line[1:].split(None, 1)
+                    if not fields:
+                        raise ValueError(
+                            f"Can't index {path}: record with no ID at byte {offset}")
+                    ids.append(fields[0].decode())
+                    offsets.append(offset)
+                offset += len(line)
+                lineno += 1
+        lengths = array("Q", [
+            end - start for start, end in zip(offsets, list(offsets[1:]) + [offset])])
+        return cls(path, fmt, ids, offsets, lengths)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, seqid):
+        return seqid in self.__positions()
+
+    def records(self, start=0, stop=None):
+        """Read a range of records, by position in the file."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return []
+        begin = self.offsets[start]
+        end = self.offsets[stop - 1] + self.lengths[stop - 1]
+        return self.__parse([(begin, end)])
+
+    def chunk(self, idx, size):
+        """Read the records in chunk number idx (from 0) of the given size."""
+        return self.records(idx * size, (idx + 1) * size)
+
+    def get(self, ids):
+        """Read the records with the given IDs, in the order given.
+
+        For duplicated IDs in the file, all records with that ID are included.
+        """
+        spans = []
+        for seqid in ids:
+            try:
+                positions = self.__positions()[seqid]
+            except KeyError as err:
+                raise KeyError(f"Sequence ID {seqid} not found in {self.path}") from err
+            for pos in positions:
+                spans.append((self.offsets[pos], self.offsets[pos] + self.lengths[pos]))
+        return self.__parse(spans)
+
+    def __positions(self):
+        if self._positions is None:
+            self._positions = {}
+            for pos, seqid in enumerate(self.ids):
+                self._positions.setdefault(seqid, []).append(pos)
+        return self._positions
+
+    def __parse(self, spans):
+        if not spans:
+            return []
+        pieces = []
+        with open(self.path, "rb") as f_in, \
+                mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for begin, end in spans:
+                piece = data[begin:end]
+                # (in case the last record in the file has no final newline)
+                if not piece.endswith(b"\n"):
+                    piece += b"\n"
+                pieces.append(piece)
+        return list(SeqIO.parse(StringIO(b"".join(pieces).decode()), self.fmt))
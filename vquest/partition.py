@@ -0,0 +1,139 @@
+"""
+Write AIRR results split into partitions by column values.
+
+Rows are written to one file per combination of values of the chosen columns,
+in nested directories named column=value, like:
+
+    locus=IGH/v_family=IGHV4/part-000.tsv
+
+A manifest.tsv file alongside lists each partition file written and its row
+count, so later queries can pick out just the files they need.
+"""
+
+import re
+import logging
+from pathlib import Path
+from .profiling import stage
+from .util import VquestError
+
+LOGGER = logging.getLogger(__name__)
+
+MANIFEST = "manifest.tsv"
+
+
+def __load_airr_columns():
+    with open(Path(__file__).parent / "data" / "airr_columns.txt") as f_in:
+        return [line.strip() for line in f_in if line.strip() and not line.startswith("#")]
+
+AIRR_COLUMNS = __load_airr_columns()
+
+
+def check_columns(columns):
+    """Raise ValueError for any column that isn't usable for partitioning."""
+    known = set(AIRR_COLUMNS)
+    for column in columns:
+        if column.endswith("_family") and column[:-len("_family")] + "_call" in known:
+            continue
+        if column not in known:
+            raise ValueError(f"Unknown AIRR column for partitioning: {column}")
+
+
+def gene_family(call):
+    """Get the gene family (e.g. IGHV4) from an AIRR gene call field."""
+    match = re.search(r"\b([A-Z]{4}\d+)", call)
+    return match.group(1) if match else ""
+
+
+class PartitionWriter:
+    """Write AIRR rows to partition files as each batch of results comes in.
+
+    columns can be any AIRR column names, plus "<x>_family" for the gene
+    family of the "<x>_call" column (e.g. v_family from v_call).  Each run
+    starts new part-NNN.tsv files rather than overwriting any already present,
+    so results from several runs can be collected into the same directory
+    tree.
+    """
+
+    def __init__(self, outdir, columns):
+        check_columns(columns)
+        self.outdir = Path(outdir)
+        self.columns = columns
+        self.counts = {}
+        self._handles = {}
+        self._header = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, output):
+        """Write AIRR rows from one batch's unzipped output."""
+        with stage("write"):
+            self.__add(output)
+
+    def __add(self, output):
+        lines = output["vquest_airr.tsv"].decode().splitlines()
+        if not lines:
+            # (These sequences count as missing and get resubmitted)
+            LOGGER.warning("Empty AIRR table in results; nothing to partition")
+            return
+        header, *rows = lines
+        if self._header is None:
+            self._header = header
+        fields = header.split("\t")
+        getters = [self.__getter(fields, column) for column in self.columns]
+        for row in rows:
+            if not row:
+                continue
+            values = row.split("\t")
+            key = tuple(getter(values) for getter in getters)
+            self.__handle(key).write(row + "\n")
+            self.counts[key] += 1
+
+    def close(self):
+        """Close all partition files and add them to the manifest."""
+        manifest = self.outdir / MANIFEST
+        new = not manifest.exists()
+        with open(manifest, "at") as f_out:
+            if new:
+                f_out.write("path\trows\n")
+            for key, handle in self._handles.items():
+                handle.close()
+                path = Path(handle.name).relative_to(self.outdir)
+                f_out.write(f"{path}\t{self.counts[key]}\n")
+        self._handles = {}
+
+    @staticmethod
+    def __getter(fields, column):
+        if column.endswith("_family") and column not in fields:
+            source = column[:-len("_family")] + "_call"
+            if source not in fields:
+                raise VquestError(
+                    f"No {source} column in AIRR results for partitioning by {column}")
+            idx = fields.index(source)
+            return lambda values: gene_family(values[idx])
+        if column not in fields:
+            raise VquestError(f"No {column} column in AIRR results for partitioning")
+        idx = fields.index(column)
+        return lambda values: values[idx]
+
+    def __handle(self, key):
+        if key not in self._handles:
+            partdir = self.outdir
+            for column, value in zip(self.columns, key):
+                # Keep values usable as directory names
+                value = re.sub(r"[^A-Za-z0-9._-]", "_", value) or "none"
+                partdir = partdir / f"{column}={value}"
+            partdir.mkdir(parents=True, exist_ok=True)
+            idx = 0
+            while (partdir / f"part-{idx:03d}.tsv").exists():
+                idx += 1
+            path = partdir / f"part-{idx:03d}.tsv"
+            LOGGER.info("Writing %s", path)
+            handle = open(path, "wt") # pylint: disable=consider-using-with
+            handle.write(self._header + "\n")
+            self._handles[key] = handle
+            self.counts[key] = 0
+        return self._handles[key]
@@ -0,0 +1,71 @@
+"""
+Estimate what a V-QUEST run would involve, without sending anything.
+"""
+
+import math
+import logging
+import requests
+from . import request
+from .request import (
+    URL, CHUNK_SIZE, _check_config, _select_records, _chunk_post_args, _server_post_args)
+from .server import WINDOW
+from .util import chunker
+
+LOGGER = logging.getLogger(__name__)
+
+LATENCY = 20 # rough guess at seconds per request, without past timings
+
+
+def plan(
+        config, transport="inline", latency=None, ids=None, index=False, server=None,
+        start_chunk=0):
+    """Summarize the requests that vquest() would send for config.
+
+    The sequences are parsed and checked and each batch's request is prepared
+    just as it would be for a real run, but nothing is sent over the network.
+    ids, index, server, and start_chunk are as for vquest(); with a server,
+    the single submission to it is counted as the one request, and the time
+    estimate includes the server's batching window and its own requests to
+    V-QUEST.
+    latency is the expected number of seconds for V-QUEST to respond to each
+    request (such as from a previous run's profile), or LATENCY if not given.
+    The result is a dictionary of:
+
+     * sequences: number of sequences
+     * unique_sequences: number of distinct sequence contents
+     * requests: number of requests to send (batches, or 1 for a server)
+     * payload_bytes: total size of the request bodies
+     * latency: seconds per request used for the estimate
+     * seconds: projected total run time
+    """
+    _check_config(config)
+    num_records, records = _select_records(config, ids, index, start_chunk)
+    if not num_records:
+        raise ValueError("No sequences supplied")
+    num_chunks = math.ceil(num_records / CHUNK_SIZE)
+    latency = LATENCY if latency is None else latency
+    # Requests are sent one at a time, each waiting DELAY seconds after the
+    # previous response arrived
+    seconds = num_chunks * latency + (num_chunks - 1) * request.DELAY
+    unique = set()
+    if server:
+        records = list(records)
+        unique.update(str(record.seq).upper() for record in records)
+        post_args = _server_post_args(config, records)
+        payload = len(requests.Request("POST", server, **post_args).prepare().body)
+        num_requests = 1
+        seconds += WINDOW
+    else:
+        payload = 0
+        for chunk in chunker(records, CHUNK_SIZE):
+            unique.update(str(record.seq).upper() for record in chunk)
+            post_args = _chunk_post_args(config, chunk, transport)
+            payload += len(requests.Request("POST", URL, **post_args).prepare().body)
+        num_requests = num_chunks
+    return {
+        "sequences": num_records,
+        "unique_sequences": len(unique),
+        "requests": num_requests,
+        "payload_bytes": payload,
+        "latency": latency,
+        "seconds": seconds}
@@ -0,0 +1,174 @@
+"""
+Time and memory profiling for each stage of a vquest run.
+
+Code throughout the package marks its stages with the stage() context
+manager, which does nothing unless a Profiler is active.  While one is, each
+stage's wall-clock time, CPU time, and memory allocations are totaled up, and
+the whole run is profiled with cProfile as well.  Wall-clock time not spent on
+the CPU (mostly waiting on the network, for the "post" stage, or pausing
+between requests, for the "delay" stage) is reported separately as wait time.
+"""
+
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+import logging
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger(__name__)
+
+_ACTIVE = None
+
+
+@contextmanager
+def stage(name):
+    """Record time and memory usage for one stage, if profiling."""
+    if _ACTIVE is None:
+        yield
+    else:
+        with _ACTIVE.stage(name):
+            yield
+
+
+def profiled(func):
+    """Wrap a function to be run on another thread, to profile it if profiling.
+
+    cProfile only covers the thread that started it, so anything run on other
+    threads is left out of the statistics unless wrapped this way.
+    """
+    if _ACTIVE is None:
+        return func
+    return _ACTIVE.profiled(func)
+
+
+def read_report(path):
+    """Load a stage report written by Profiler.write into nested dictionaries.
+
+    The outer keys are stage names and the inner keys are the report's column
+    names, with numeric values.
+    """
+    with open(path) as f_in:
+        header = f_in.readline().rstrip("\n").split("\t")
+        report = {}
+        for line in f_in:
+            name, *vals = line.rstrip("\n").split("\t")
+            report[name] = {key: float(val) for key, val in zip(header[1:], vals)}
+    return report
+
+
+class _Stage: # pylint: disable=too-few-public-methods
+    """Running totals for one stage."""
+
+    __slots__ = ("calls", "wall", "cpu", "alloc", "peak")
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0
+        self.cpu = 0
+        self.alloc = 0
+        self.peak = 0
+
+
+class Profiler:
+    """Profile vquest stages while active, as a context manager.
+
+    For example:
+
+        with Profiler() as prof:
+            result = vquest(config)
+            result["vquest_airr.tsv"]
+        prof.write("vquest_profile")
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.profile = cProfile.Profile()
+        self.thread_profiles = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """Start profiling."""
+        global _ACTIVE # pylint: disable=global-statement
+        tracemalloc.start()
+        self.profile.enable()
+        _ACTIVE = self
+
+    def stop(self):
+        """Stop profiling."""
+        global _ACTIVE # pylint: disable=global-statement
+        _ACTIVE = None
+        self.profile.disable()
+        tracemalloc.stop()
+
+    @contextmanager
+    def stage(self, name):
+        """Record time and memory usage for one stage."""
+        totals = self.stages.setdefault(name, _Stage())
+        mem_start = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            totals.calls += 1
+            totals.wall += time.perf_counter() - wall_start
+            totals.cpu += time.process_time() - cpu_start
+            mem_end, mem_peak = tracemalloc.get_traced_memory()
+            totals.alloc += mem_end - mem_start
+            totals.peak = max(totals.peak, mem_peak - mem_start)
+
+    def profiled(self, func):
+        """Wrap a function to be run on another thread, to include it in the profile."""
+        def wrapper(*args, **kwargs):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # (Newer Python versions allow only one profiler at a time,
+                # but that one then covers every thread already)
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                with self._lock:
+                    self.thread_profiles.append(profile)
+        return wrapper
+
+    def report(self):
+        """Summarize each stage as a text table."""
+        lines = ["stage\tcalls\twall_s\tcpu_s\twait_s\tpeak_mib\tretained_mib"]
+        for name, totals in self.stages.items():
+            lines.append("%s\t%d\t%.3f\t%.3f\t%.3f\t%.2f\t%.2f" % (
+                name, totals.calls, totals.wall, totals.cpu,
+                max(0, totals.wall - totals.cpu),
+                totals.peak / 2**20, totals.alloc / 2**20))
+        return "\n".join(lines) + "\n"
+
+    def write(self, prefix):
+        """Write the stage report to prefix.txt and cProfile stats to prefix.pstats.
+
+        The cProfile stats include any functions run on other threads via
+        profiled().
+        """
+        prefix = str(prefix)
+        LOGGER.info("Writing %s.txt", prefix)
+        with open(prefix + ".txt", "wt") as f_out:
+            f_out.write(self.report())
+        LOGGER.info("Writing %s.pstats", prefix)
+        stats = pstats.Stats(self.profile)
+        with self._lock:
+            for profile in self.thread_profiles:
+                stats.add(profile)
+        stats.dump_stats(prefix + ".pstats")
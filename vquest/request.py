@@ -4,18 +4,31 @@ Send requests to the IMGT/V-QUEST server.
 
 import time
 import logging
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
 from io import StringIO
 from pathlib import Path
 import requests
 from requests_html import HTML
 from Bio import SeqIO
-from .util import unzip, chunker, VquestError
+from .util import unzip, chunker, VquestError, DeadlineError
+from .result import VquestResult
+from .profiling import stage, profiled
+from .index import SequenceIndex
 
 LOGGER = logging.getLogger(__name__)
 
 URL = "https://www.imgt.org/IMGT_vquest/analysis"
 DELAY = 1 # for rate-limiting multiple requests
 CHUNK_SIZE = 50 # to stay within V-QUEST's limit on sequences in one go
+# Ways of sending each chunk of sequences: as form text in the "sequences"
+# field, or as a multipart file upload in the "fileSequences" field
+TRANSPORTS = ("inline", "file")
+RETRIES = 2 # resubmissions for sequences missing from a chunk's results
+DEADLINE = 600 # seconds to wait for results for any one chunk
+HEDGE_HISTORY = 20 # recent request times to consider for hedging
+HEDGE_MIN_HISTORY = 5 # fewest recent request times needed before hedging
 
 EXTS = {
     ".fasta": "fasta",
@@ -24,8 +37,20 @@ EXTS = {
     ".fastq": "fastq",
     ".fq": "fastq"}
 
-def _parse_records(config):
-    """Extract Seq records for sequences given in config"""
+def _file_format(path):
+    """Get the sequence format for a file path from its extension."""
+    try:
+        return EXTS[Path(path).suffix.lower()]
+    except KeyError as err:
+        raise ValueError(f"File format not recognized for {path}") from err
+
+def _parse_records(config, ids=None):
+    """Extract Seq records for sequences given in config
+
+    If ids is given, only records with those sequence IDs are included, and
+    records from fileSequences are read via a SequenceIndex, which is saved
+    alongside the file for later use.
+    """
     records = []
     if "sequences" in config and config["sequences"]:
         if config["sequences"].startswith("@"):
@@ -36,18 +61,52 @@ def _parse_records(config):
             raise ValueError("Sequence format not recognized")
         with StringIO(config["sequences"]) as seqs_stream:
             records.extend(list(SeqIO.parse(seqs_stream, fmt)))
+        if ids is not None:
+            wanted = set(ids)
+            records = [record for record in records if record.id in wanted]
     if "fileSequences" in config and config["fileSequences"]:
         path = Path(config["fileSequences"])
-        ext = path.suffix.lower()
-        try:
-            fmt = EXTS[ext]
-        except KeyError as err:
-            raise ValueError(f"File format not recognized for {path}") from err
-        with open(path) as f_in:
-            records.extend(list(SeqIO.parse(f_in, fmt)))
+        fmt = _file_format(path)
+        if ids is not None:
+            seqindex = SequenceIndex.load(path, fmt)
+            records.extend(seqindex.get([seqid for seqid in ids if seqid in seqindex]))
+        else:
+            with open(path) as f_in:
+                records.extend(list(SeqIO.parse(f_in, fmt)))
+    if ids is not None:
+        found = {record.id for record in records}
+        absent = [seqid for seqid in ids if seqid not in found]
+        if absent:
+            LOGGER.warning(
+                "%d requested sequence IDs not found: %s", len(absent), " ".join(absent))
     return records
 
-def vquest(config, collapse=True):
+def _select_records(config, ids=None, index=False, start_chunk=0):
+    """Count and iterate over the Seq records to submit for config.
+
+    ids is as for _parse_records.  Otherwise, with index=True, records from
+    fileSequences are read one chunk at a time via a SequenceIndex rather
+    than all at once.  The first start_chunk chunks (of CHUNK_SIZE records)
+    are skipped.  Returns the number of records and an iterator over them.
+    """
+    skip = start_chunk * CHUNK_SIZE
+    if ids is not None or not index or not config.get("fileSequences"):
+        records = _parse_records(config, ids)[skip:]
+        return len(records), iter(records)
+    inline = _parse_records({"sequences": config.get("sequences")})[skip:]
+    path = config["fileSequences"]
+    seqindex = SequenceIndex.load(path, _file_format(path))
+    first = max(0, skip - len(inline))
+    def records():
+        yield from inline
+        for pos in range(first, len(seqindex), CHUNK_SIZE):
+            yield from seqindex.records(pos, pos + CHUNK_SIZE)
+    return len(inline) + max(0, len(seqindex) - first), records()
+
+def vquest(
+        config, collapse=True, server=None, transport="inline", retries=RETRIES,
+        on_chunk=None, deadline=DEADLINE, hedge=None, ids=None, index=False,
+        start_chunk=0):
     """Submit a request to V-QUEST.
 
     config should be a dictionary key/value pairs to use in the request.  See
@@ -58,10 +117,94 @@ def vquest(config, collapse=True):
     sequences are batched into sets of 50 (the most allowed by V-QUEST) and
     submitted one batch at a time.  If collapse is True, results are combined
     as though they were submitted and processed as a single request, and a
-    dictionary of file names to text contents is returned.  If collapse is
-    False, a list of dictionaries is returned, one for each batch, storing raw
-    byte contents.
+    VquestResult is returned, which acts as a dictionary of file names to text
+    contents (decoded on demand) and also gives access to individual AIRR rows
+    and columns.  If collapse is False, a list of dictionaries is returned,
+    one for each batch, storing raw byte contents.
+
+    If server is given as the URL of a running "vquest --serve" instance, the
+    sequences are handed to that server instead, which batches them together
+    with sequences from other clients before submitting to V-QUEST.
+
+    transport sets how each batch is sent: "inline" as URL-encoded form text,
+    or "file" as a multipart file upload, which is more compact.
+
+    The sequence IDs in each batch's AIRR results are checked against the
+    sequences submitted, and any sequences missing from the results are
+    resubmitted, up to the given number of retries.
+
+    If on_chunk is given, it is called with each batch's output dictionary (of
+    raw byte contents) as soon as that batch is received.
+
+    Each batch must finish within deadline seconds (None for no limit), or its
+    sequences count as missing and are resubmitted like any others.  (Via a
+    server, the deadline applies to each chunk the server sends.)  If hedge is given as a percentile (such as 95),
+    any batch taking longer than that percentile of recent batches is sent
+    again, and whichever request finishes first is used.  See Pacer.
+
+    If ids is given as a list of sequence IDs, only those sequences are
+    submitted.  For fileSequences these are read directly from the file via an
+    index of record positions, which is built (as a .vqi file alongside the
+    sequence file) if needed and reused later.  index=True reads
+    fileSequences via that index one batch at a time, rather than all at once.
+
+    If start_chunk is given, that many batches at the start are skipped (for
+    example, to resume an interrupted run).
     """
+    _check_config(config)
+    with stage("parse"):
+        num_records, records = _select_records(config, ids, index, start_chunk)
+    if not num_records:
+        raise ValueError("No sequences supplied")
+    if server:
+        chunks = [list(records)]
+        send = partial(_vquest_via_server, config, server=server, deadline=deadline)
+    else:
+        chunks = chunker(records, CHUNK_SIZE)
+        pacer = Pacer(deadline=deadline, hedge=hedge)
+        send = partial(_submit_chunk, config, transport=transport, pacer=pacer)
+    LOGGER.info("Starting request batch for %d sequences total", num_records)
+    outputs = []
+    missing = []
+    duplicated = []
+    for chunk in chunks:
+        for attempt in range(retries + 1):
+            try:
+                output = send(chunk)
+            except DeadlineError as err:
+                # The whole chunk counts as missing, to be resubmitted
+                LOGGER.warning("%s", err.message)
+            else:
+                outputs.append(output)
+                if on_chunk:
+                    on_chunk(output)
+                with stage("check"):
+                    chunk, chunk_duplicated = _check_chunk(chunk, output)
+                duplicated.extend(chunk_duplicated)
+                if not chunk:
+                    break
+            if attempt < retries:
+                LOGGER.warning(
+                    "%d sequences missing from results; resubmitting", len(chunk))
+        missing.extend(chunk)
+    LOGGER.info(
+        "Received results for %d of %d sequences in %d requests",
+        num_records - len(missing), num_records, len(outputs))
+    if duplicated:
+        LOGGER.warning(
+            "%d sequence IDs had extra rows in results: %s",
+            len(duplicated), " ".join(duplicated))
+    if missing:
+        LOGGER.warning(
+            "%d sequences still missing from results after %d retries: %s",
+            len(missing), retries, " ".join(record.id for record in missing))
+    if not collapse:
+        return outputs
+    return VquestResult(
+        outputs, missing=[record.id for record in missing], duplicated=duplicated)
+
+def _check_config(config):
+    """Raise an exception if config can't be used for a V-QUEST request."""
     if not all([
         config.get("species"),
         config.get("receptorOrLocusType"),
@@ -70,52 +213,228 @@ def vquest(config, collapse=True):
             "species, receptorOrLocusType, and fileSequences "
             "and/or sequences are required options")
     supported = [("resultType", "excel"), ("xv_outputtype", 3)]
-    if all([config.get(pair[0]) == pair[1] for pair in supported]):
-        outputs = []
-        records = _parse_records(config)
-        if not records:
-            raise ValueError("No sequences supplied")
-        LOGGER.info("Starting request batch for %d sequences total", len(records))
-        for chunk in chunker(records, CHUNK_SIZE):
-            if outputs:
-                time.sleep(DELAY)
-            LOGGER.info("Sending request with %d sequences...", len(chunk))
-            out_handle = StringIO()
-            SeqIO.write(chunk, out_handle, "fasta")
-            config_chunk = config.copy()
-            config_chunk["sequences"] = out_handle.getvalue()
-            config_chunk["inputType"] = "inline"
-            response = requests.post(URL, data = config_chunk)
-            ctype = response.headers.get("Content-Type")
-            LOGGER.debug("Received data of type %s", ctype)
-            if ctype and "text/html" in ctype:
-                html = HTML(html=response.content)
-                errors = [div.text for div in html.find("div.form_error")]
-                if errors:
-                    raise VquestError("; ".join(errors), errors)
-            outputs.append(unzip(response.content))
-        if not collapse:
-            return outputs
-        return _collapse_outputs(outputs)
-    needed = " ".join([pair[0] + "=" + str(pair[1]) for pair in supported])
-    observed = " ".join([pair[0] + "=" + str(config.get(pair[0])) for pair in supported])
-    raise NotImplementedError(("Only " + needed + " currently supported, not " + observed))
-
-def _collapse_outputs(outputs):
-    """Combine batched output dictionaries into one."""
-    output = {}
-    for output_chunk in outputs:
-        # Only keep one copy of the Parameters.txt data, but append rows
-        # (minus header) of vquest_airr.tsv together
-        if "Parameters.txt" not in output:
-            output["Parameters.txt"] = output_chunk["Parameters.txt"].decode()
-        if "vquest_airr.tsv" not in output:
-            output["vquest_airr.tsv"] = output_chunk["vquest_airr.tsv"].decode()
-        else:
-            airr = output_chunk["vquest_airr.tsv"].decode()
-            output["vquest_airr.tsv"] += "\n".join(airr.splitlines()[1:])
-        # I've seen cases where there may or may not be a final newline, so
-        # let's make sure there always is
-        if not output["vquest_airr.tsv"].endswith("\n"):
-            output["vquest_airr.tsv"] += "\n"
-    return output
+    if not all([config.get(pair[0]) == pair[1] for pair in supported]):
+        needed = " ".join([pair[0] + "=" + str(pair[1]) for pair in supported])
+        observed = " ".join([pair[0] + "=" + str(config.get(pair[0])) for pair in supported])
+        raise NotImplementedError(("Only " + needed + " currently supported, not " + observed))
+
+def _check_chunk(chunk, output):
+    """Match submitted Seq records to the rows of a chunk's AIRR results.
+
+    Returns a list of records with no corresponding row and a list of
+    sequence IDs with more rows than records submitted.
+    """
+    expected = Counter(record.id for record in chunk)
+    observed = Counter()
+    for seqid in _airr_ids(output["vquest_airr.tsv"]):
+        # Just in case the whole FASTA description line ends up as the ID
+        if seqid not in expected:
+            seqid = seqid.split(" ")[0]
+        observed[seqid] += 1
+    duplicated = [seqid for seqid, count in observed.items() if count > expected[seqid]]
+    missing = []
+    for record in reversed(chunk):
+        if observed[record.id] < expected[record.id]:
+            missing.insert(0, record)
+            expected[record.id] -= 1
+    return missing, duplicated
+
+def _airr_ids(airr):
+    """List the sequence_id column from AIRR TSV bytes.
+
+    An empty table, or one without a sequence_id column, gives no IDs, so all
+    of that chunk's sequences will count as missing.
+    """
+    lines = airr.splitlines()
+    if not lines:
+        LOGGER.warning("Empty AIRR table in results")
+        return []
+    header, *rows = lines
+    try:
+        idx = header.split(b"\t").index(b"sequence_id")
+    except ValueError:
+        LOGGER.warning("No sequence_id column in AIRR results")
+        return []
+    return [fields[idx].decode() for fields in (row.split(b"\t") for row in rows if row)
+        if len(fields) > idx]
+
+def _submit_chunk(config, chunk, transport="inline", pacer=None):
+    """Send one chunk of Seq records to V-QUEST and return unzipped output."""
+    LOGGER.info("Sending request with %d sequences...", len(chunk))
+    pacer = pacer or Pacer()
+    with stage("serialize"):
+        post_args = _chunk_post_args(config, chunk, transport)
+    with stage("delay"):
+        pacer.wait()
+    with stage("post"):
+        response = pacer.post(URL, **post_args)
+    ctype = response.headers.get("Content-Type")
+    LOGGER.debug("Received data of type %s", ctype)
+    if ctype and "text/html" in ctype:
+        html = HTML(html=response.content)
+        errors = [div.text for div in html.find("div.form_error")]
+        if errors:
+            raise VquestError("; ".join(errors), errors)
+    with stage("unzip"):
+        return unzip(response.content)
+
+def _chunk_post_args(config, chunk, transport="inline"):
+    """Prepare keyword arguments for the POST request for one chunk."""
+    config_chunk = config.copy()
+    if transport == "inline":
+        out_handle = StringIO()
+        SeqIO.write(chunk, out_handle, "fasta")
+        config_chunk["sequences"] = out_handle.getvalue()
+        config_chunk["inputType"] = "inline"
+        return {"data": config_chunk}
+    if transport == "file":
+        config_chunk.pop("sequences", None)
+        config_chunk.pop("fileSequences", None)
+        config_chunk["inputType"] = "file"
+        upload = ("sequences.fasta", _fasta_bytes(chunk), "text/plain")
+        return {"data": config_chunk, "files": {"fileSequences": upload}}
+    raise ValueError(f"transport must be one of {TRANSPORTS}, not {transport}")
+
+def _fasta_bytes(records):
+    """Format Seq records as unwrapped FASTA, directly as bytes."""
+    lines = []
+    for record in records:
+        title = record.id
+        if record.description and record.description.split(None, 1)[0] == record.id:
+            title = record.description
+        elif record.description:
+            title += " " + record.description
+        lines.append(b">%s\n%s\n" % (title.encode(), bytes(record.seq)))
+    return b"".join(lines)
+
+def _vquest_via_server(config, records, server, deadline=DEADLINE):
+    """Hand Seq records to a coalescing server and return its output.
+
+    The output is given as a dictionary of raw byte contents, just like the
+    results of a single chunk sent to V-QUEST.  deadline limits the wait for
+    the server's response for each chunk (None for no limit), and the server
+    is told to use the same overall limit.
+    """
+    # (Imported here since the server module itself builds on this one)
+    from .server import submit_limit, GRACE # pylint: disable=import-outside-toplevel
+    LOGGER.info("Sending %d sequences to server at %s", len(records), server)
+    limit = submit_limit(deadline, len(records))
+    with stage("serialize"):
+        post_args = _server_post_args(config, records, limit)
+    with stage("post"):
+        try:
+            response = requests.post(server, **post_args, timeout=limit and limit + GRACE)
+        except requests.exceptions.Timeout as err:
+            raise DeadlineError(f"No response from server within {limit} s") from err
+    data = response.json()
+    if "error" in data:
+        raise VquestError(data["error"], data.get("server_messages"))
+    return {key: val.encode() for key, val in data.items()}
+
+def _server_post_args(config, records, limit=None):
+    """Keyword arguments for requests.post to submit Seq records to a server."""
+    out_handle = StringIO()
+    SeqIO.write(records, out_handle, "fasta")
+    config_server = {
+        key: val for key, val in config.items()
+        if key not in ("sequences", "fileSequences")}
+    return {"json": {
+        "config": config_server, "sequences": out_handle.getvalue(), "limit": limit}}
+
+class Pacer:
+    """Send POST requests politely, with deadlines and optional hedging.
+
+    wait() should be called before each post(), and sleeps until DELAY
+    seconds have passed since the most recent request was sent or its
+    response arrived, whichever is later.  If deadline is set, each call to
+    post() raises a DeadlineError if no response arrives in that many seconds.
+    If hedge is set to a percentile, a duplicate request is sent when the
+    first one has been waiting longer than that percentile of recent request
+    times, and the first response to arrive is used.  A hedged request waits
+    out the same delay as any other, and also adds one more DELAY before the
+    next request, so it uses up its own share of the rate limit.  (The slower
+    request can't be interrupted once sent, so it's left to finish or time out
+    on its own and its response is discarded.)
+    """
+
+    def __init__(self, delay=None, deadline=DEADLINE, hedge=None):
+        if hedge is not None and not 0 <= hedge <= 100:
+            raise ValueError(f"hedge must be a percentile from 0 to 100, not {hedge}")
+        self.delay = DELAY if delay is None else delay
+        self.deadline = deadline
+        self.hedge = hedge
+        self.times = deque(maxlen=HEDGE_HISTORY)
+        self._last_activity = None
+        self._owed = 0
+
+    def wait(self):
+        """Sleep until another request may be sent."""
+        if self._last_activity is not None:
+            elapsed = time.monotonic() - self._last_activity
+            time.sleep(max(0, self.delay + self._owed - elapsed))
+        self._owed = 0
+
+    def post(self, url, **kwargs):
+        """Send a POST request and return the first response received."""
+        if self.deadline:
+            kwargs["timeout"] = self.deadline
+        start = time.monotonic()
+        self._last_activity = start
+        try:
+            if self.hedge is None:
+                # Without hedging there's no need for another thread (which
+                # would also hide the request from cProfile)
+                response = requests.post(url, **kwargs)
+            else:
+                response = self.__post_hedged(url, kwargs, start)
+        except requests.exceptions.Timeout as err:
+            raise DeadlineError(f"No response within deadline of {self.deadline} s") from err
+        finally:
+            self._last_activity = time.monotonic()
+        self.times.append(time.monotonic() - start)
+        return response
+
+    def hedge_after(self):
+        """Seconds to wait before hedging, or None if not hedging yet."""
+        if self.hedge is None or len(self.times) < HEDGE_MIN_HISTORY:
+            return None
+        times = sorted(self.times)
+        return times[round(self.hedge / 100 * (len(times) - 1))]
+
+    def __post_hedged(self, url, kwargs, start):
+        executor = ThreadPoolExecutor(max_workers=2)
+        futures = set()
+        try:
+            futures.add(self.__send(executor, url, kwargs))
+            hedge_after = self.hedge_after()
+            if hedge_after is not None and (not self.deadline or hedge_after < self.deadline):
+                done, _ = wait(futures, timeout=hedge_after)
+                if not done:
+                    self.wait()
+                    done, _ = wait(futures, timeout=0)
+                if not done:
+                    LOGGER.warning(
+                        "No response after %.1f s; sending hedged request",
+                        time.monotonic() - start)
+                    futures.add(self.__send(executor, url, kwargs))
+                    self._owed += self.delay
+            while futures:
+                remaining = None
+                if self.deadline:
+                    remaining = max(0, self.deadline - (time.monotonic() - start))
+                done, futures = wait(futures, timeout=remaining, return_when=FIRST_COMPLETED)
+                if not done:
+                    raise DeadlineError(f"No response within deadline of {self.deadline} s")
+                for future in done:
+                    # If one request failed outright, give any other a chance
+                    if future.exception() is None or not futures:
+                        return future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+        return None
+
+    def __send(self, executor, url, kwargs):
+        self._last_activity = time.monotonic()
+        return executor.submit(profiled(requests.post), url, **kwargs)
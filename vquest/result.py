@@ -0,0 +1,147 @@
+"""
+Combined V-QUEST results, decoded only as needed.
+"""
+
+from io import BytesIO
+from pathlib import Path
+from collections import namedtuple
+from collections.abc import Mapping
+from .profiling import stage
+
+AIRR = "vquest_airr.tsv"
+
+
+class VquestResult(Mapping):
+    """Read-only mapping of output file names to text contents.
+
+    This holds onto the raw bytes for each batch of results (or paths to files
+    on disk) and only decodes and combines them when a file's text is actually
+    asked for, so it can be used just like the dictionary of file names to
+    text that vquest() used to give.  AIRR rows can also be read one at a time
+    via rows(), or one column at a time via column(), without building the
+    combined text at all.
+
+    missing and duplicated list sequence IDs that had no row or more than one
+    row in the results, respectively.
+    """
+
+    def __init__(self, outputs, missing=None, duplicated=None):
+        self.outputs = outputs
+        self.missing = missing or []
+        self.duplicated = duplicated or []
+        self._decoded = {}
+        self._header = None
+        self._row_type = None
+        self._airr_batches = None
+
+    @classmethod
+    def from_dir(cls, path):
+        """Load results previously written to a directory.
+
+        This can be either a single set of output files or numbered
+        subdirectories for each batch, as written with --no-collapse.
+        """
+        path = Path(path)
+        chunkdirs = sorted(p for p in path.iterdir() if p.is_dir() and p.name.isdigit())
+        outputs = []
+        for chunkdir in chunkdirs or [path]:
+            outputs.append({p.name: p for p in sorted(chunkdir.iterdir()) if p.is_file()})
+        return cls(outputs)
+
+    def __getitem__(self, key):
+        if key not in self._decoded:
+            if key not in self:
+                raise KeyError(key)
+            if key == AIRR:
+                with stage("collapse"):
+                    self._decoded[key] = self.__combine_airr()
+            else:
+                # Only keep one copy of anything other than the AIRR table
+                # (e.g. Parameters.txt)
+                self._decoded[key] = self._chunk_bytes(self._first_batch(), key).decode()
+        return self._decoded[key]
+
+    def __contains__(self, key):
+        return bool(self.outputs) and key in self.outputs[self._first_batch()]
+
+    def __iter__(self):
+        if self.outputs:
+            yield from self.outputs[self._first_batch()]
+
+    def __len__(self):
+        return len(self.outputs[self._first_batch()]) if self.outputs else 0
+
+    @property
+    def header(self):
+        """Tuple of AIRR column names."""
+        if self._header is None:
+            batches = self._nonempty_airr()
+            line = self._chunk_bytes(batches[0], AIRR).split(b"\n", 1)[0] if batches else b""
+            self._header = tuple(line.rstrip(b"\r").decode().split("\t")) if line else ()
+        return self._header
+
+    def rows(self):
+        """Iterate over AIRR rows as named tuples, across all batches."""
+        if self._row_type is None:
+            self._row_type = namedtuple("AirrRow", self.header, rename=True)
+        for fields in self._split_rows():
+            yield self._row_type(*(field.decode() for field in fields))
+
+    def column(self, name):
+        """List the values of one AIRR column, across all batches."""
+        idx = self.header.index(name)
+        return [fields[idx].decode() for fields in self._split_rows()]
+
+    def to_dataframe(self):
+        """Load the AIRR rows into a pandas DataFrame (requires pandas)."""
+        import pandas # pylint: disable=import-outside-toplevel
+        frames = [
+            pandas.read_csv(BytesIO(self._chunk_bytes(idx, AIRR)), sep="\t")
+            for idx in self._nonempty_airr()]
+        return pandas.concat(frames, ignore_index=True)
+
+    def _chunk_bytes(self, idx, key):
+        """Raw contents of one batch's output file."""
+        data = self.outputs[idx][key]
+        if isinstance(data, Path):
+            data = data.read_bytes()
+        return data
+
+    def _nonempty_airr(self):
+        """Indexes of batches with a non-empty AIRR table.
+
+        A batch can come back with an empty table (its sequences then count as
+        missing and are resubmitted), which has no header to go by.
+        """
+        if self._airr_batches is None:
+            self._airr_batches = [
+                idx for idx in range(len(self.outputs))
+                if AIRR in self.outputs[idx] and self._chunk_bytes(idx, AIRR).strip()]
+        return self._airr_batches
+
+    def _first_batch(self):
+        """Index of the batch that file names (and non-AIRR files) come from."""
+        batches = self._nonempty_airr()
+        return batches[0] if batches else 0
+
+    def _split_rows(self):
+        """Iterate over AIRR rows (minus header) as lists of byte fields."""
+        for idx in self._nonempty_airr():
+            for line in self._chunk_bytes(idx, AIRR).splitlines()[1:]:
+                if line:
+                    yield line.split(b"\t")
+
+    def __combine_airr(self):
+        """Append rows (minus header) of each batch's AIRR table together."""
+        combined = ""
+        for idx in self._nonempty_airr():
+            airr = self._chunk_bytes(idx, AIRR).decode()
+            if not combined:
+                combined = airr
+            else:
+                combined += "\n".join(airr.splitlines()[1:])
+            # I've seen cases where there may or may not be a final newline, so
+            # let's make sure there always is
+            if not combined.endswith("\n"):
+                combined += "\n"
+        return combined
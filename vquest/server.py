@@ -0,0 +1,307 @@
+"""
+Local server that coalesces V-QUEST requests from many clients.
+
+Each client submits its sequences along with its V-QUEST options.  Sequences
+from clients with identical options are packed together into full chunks
+(within a short batching window) and submitted to V-QUEST one chunk at a time,
+and the AIRR rows from each chunk are routed back to the client that supplied
+each sequence.
+"""
+
+import json
+import math
+import time
+import select
+import socket
+import logging
+import threading
+from io import StringIO
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from Bio import SeqIO
+from . import request
+from .util import VquestError
+
+LOGGER = logging.getLogger(__name__)
+
+HOST = "localhost"
+PORT = 8850
+WINDOW = 2 # seconds to wait for more sequences before sending a partial chunk
+GRACE = 5 # extra seconds a client waits, so the server's own timeout reaches it
+POLL = 1 # seconds between checks that a waiting client is still connected
+
+
+def submit_limit(deadline, num_records, window=WINDOW, chunk_size=request.CHUNK_SIZE):
+    """Seconds a submission may wait for all of its results (None for no limit).
+
+    This is the batching window plus the deadline for each chunk.
+    """
+    if not deadline:
+        return None
+    return window + deadline * math.ceil(num_records / chunk_size)
+
+
+class _Job:
+    """One client's submission, tracked until all of its rows are back."""
+
+    def __init__(self, config, records):
+        self.config = config
+        self.records = records
+        self.arrival = time.monotonic()
+        self.unsent = list(records)
+        self.outstanding = 0
+        self.parameters = None
+        self.header = None
+        self.rows = []
+        self.error = None
+        self.done = threading.Event()
+
+    def output(self):
+        """Output for this job, like the unzipped output of one chunk."""
+        airr = self.header + b"".join(self.rows)
+        return {"Parameters.txt": self.parameters, "vquest_airr.tsv": airr}
+
+
+class Coalescer:
+    """Group submitted sequences by option set and send them in full chunks.
+
+    submit() can be called from any number of threads at once, and blocks
+    until that submission's results are available.  If deadline is set, a
+    submission is given up on (and a VquestError raised) when its results
+    haven't all arrived within the batching window plus the deadline for each
+    of its chunks (see submit_limit).  A single worker thread
+    does the actual requests to V-QUEST, so the usual delay between requests
+    applies across all clients.
+    """
+
+    def __init__(
+            self, window=WINDOW, chunk_size=request.CHUNK_SIZE, transport="inline",
+            deadline=request.DEADLINE, hedge=None):
+        self.window = window
+        self.transport = transport
+        self.chunk_size = chunk_size
+        self.deadline = deadline
+        self.pacer = request.Pacer(deadline=deadline, hedge=hedge)
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._worker = threading.Thread(target=self._work, daemon=True)
+        self._worker.start()
+
+    def submit(self, config, records, limit=None, connected=None):
+        """Queue Seq records for the given config and wait for the output.
+
+        limit is the most seconds to wait (by default from submit_limit with
+        this Coalescer's own deadline), and connected can be a function
+        telling whether the client is still there to receive the output.
+        Either way, the submission's unsent records are withdrawn on giving
+        up.
+        """
+        if not records:
+            raise ValueError("No sequences supplied")
+        if limit is None:
+            limit = submit_limit(self.deadline, len(records), self.window, self.chunk_size)
+        job = _Job(config, records)
+        key = json.dumps(config, sort_keys=True, default=str)
+        with self._cond:
+            self._pending.setdefault(key, []).append(job)
+            self._cond.notify_all()
+        give_up = time.monotonic() + limit if limit else None
+        while True:
+            timeout = POLL
+            if give_up is not None:
+                timeout = min(POLL, max(0, give_up - time.monotonic()))
+            if job.done.wait(timeout):
+                break
+            if give_up is not None and time.monotonic() >= give_up:
+                self._withdraw(key, job)
+                raise VquestError(f"No results within {limit} s")
+            if connected and not connected():
+                self._withdraw(key, job)
+                raise ConnectionResetError("Client disconnected")
+        if job.error:
+            raise job.error
+        return job.output()
+
+    def _withdraw(self, key, job):
+        """Drop a job's unsent records, so they're never sent."""
+        with self._cond:
+            job.unsent.clear()
+            group = self._pending.get(key, [])
+            if job in group:
+                group.remove(job)
+                if not group:
+                    del self._pending[key]
+            self._cond.notify_all()
+
+    def _work(self):
+        while True:
+            config, chunk, jobs = self._next_chunk()
+            try:
+                output = request._submit_chunk(config, chunk, self.transport, self.pacer)
+                self._route(output, jobs)
+            except Exception as err: # pylint: disable=broad-except
+                # Anything going wrong here has to be handed back to the
+                # waiting clients rather than stopping the worker thread
+                self._fail(err, jobs)
+
+    def _next_chunk(self):
+        """Wait for a full chunk or the end of the batching window, then take it.
+
+        The group of jobs that has been waiting longest is served first.  A
+        chunk never contains the same sequence ID from two different jobs, so
+        that every AIRR row in the output can be matched to one job.
+        """
+        with self._cond:
+            while True:
+                while not self._pending:
+                    self._cond.wait()
+                key = min(self._pending, key=lambda k: self._pending[k][0].arrival)
+                group = self._pending[key]
+                config = group[0].config
+                deadline = group[0].arrival + self.window
+                while group:
+                    remaining = deadline - time.monotonic()
+                    if sum(len(job.unsent) for job in group) >= self.chunk_size or remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                # (Every job in the group may have been withdrawn meanwhile)
+                if group:
+                    break
+            chunk = []
+            jobs = {}
+            for job in group:
+                while job.unsent and len(chunk) < self.chunk_size:
+                    seqid = job.unsent[0].id
+                    if jobs.get(seqid, job) is not job:
+                        break
+                    jobs[seqid] = job
+                    chunk.append(job.unsent.pop(0))
+            for job in set(jobs.values()):
+                job.outstanding += 1
+            group[:] = [job for job in group if job.unsent]
+            if not group:
+                del self._pending[key]
+            return config, chunk, jobs
+
+    @staticmethod
+    def _route(output, jobs):
+        """Hand each AIRR row back to the job it belongs to."""
+        parameters = output["Parameters.txt"]
+        header, *rows = output["vquest_airr.tsv"].splitlines(keepends=True)
+        if not header.endswith(b"\n"):
+            header += b"\n"
+        idx = header.rstrip(b"\r\n").split(b"\t").index(b"sequence_id")
+        routed = {job: [] for job in jobs.values()}
+        for row in rows:
+            if not row.endswith(b"\n"):
+                row += b"\n"
+            seqid = row.rstrip(b"\r\n").split(b"\t")[idx].decode()
+            job = jobs.get(seqid) or jobs.get(seqid.split(" ")[0])
+            if job:
+                routed[job].append(row)
+            else:
+                LOGGER.warning("No client found for sequence %s", seqid)
+        # Only hand anything over once the whole output has been handled, so
+        # an error partway through doesn't leave a job with partial rows
+        for job, job_rows in routed.items():
+            job.rows.extend(job_rows)
+            job.parameters = job.parameters or parameters
+            job.header = job.header or header
+            Coalescer._finish(job)
+
+    @staticmethod
+    def _fail(err, jobs):
+        """Hand an error back to each job in a chunk."""
+        for job in set(jobs.values()):
+            job.error = err
+            Coalescer._finish(job)
+
+    @staticmethod
+    def _finish(job):
+        """Mark one chunk of a job as handled, and the job done if it's the last."""
+        job.outstanding -= 1
+        if not job.outstanding and not job.unsent:
+            job.done.set()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _make_handler(coalescer):
+    class Handler(BaseHTTPRequestHandler):
+        """Accept JSON submissions with "config" and "sequences" entries."""
+
+        def do_POST(self): # pylint: disable=invalid-name
+            """Queue the submitted sequences and reply with their output."""
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                data = json.loads(self.rfile.read(length))
+                config = data["config"]
+                records = list(SeqIO.parse(StringIO(data["sequences"]), "fasta"))
+                limit = data.get("limit")
+                limit = None if limit is None else float(limit)
+            except (ValueError, KeyError, TypeError) as err:
+                self.__reply(400, {"error": f"Invalid submission: {err}"})
+                return
+            LOGGER.info("Received %d sequences from %s", len(records), self.client_address[0])
+            try:
+                output = coalescer.submit(config, records, limit, self.__connected)
+                status = 200
+                reply = {key: val.decode() for key, val in output.items()}
+            except ConnectionError:
+                LOGGER.info("Client %s disconnected", self.client_address[0])
+                return
+            except VquestError as err:
+                status = 502
+                reply = {"error": err.message, "server_messages": err.server_messages}
+            except Exception as err: # pylint: disable=broad-except
+                status = 500
+                reply = {"error": str(err)}
+            self.__reply(status, reply)
+
+        def __reply(self, status, reply):
+            body = json.dumps(reply).encode()
+            try:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                LOGGER.info("Client %s disconnected before reply", self.client_address[0])
+
+        def __connected(self):
+            # A closed connection reads as ready, with nothing to read
+            try:
+                readable, _, _ = select.select([self.connection], [], [], 0)
+                return not readable or self.connection.recv(1, socket.MSG_PEEK) != b""
+            except OSError:
+                return False
+
+        def log_message(self, format, *args): # pylint: disable=redefined-builtin
+            LOGGER.debug(format, *args)
+
+    return Handler
+
+
+def make_server(
+        host=HOST, port=PORT, window=WINDOW, transport="inline",
+        deadline=request.DEADLINE, hedge=None):
+    """Set up (but don't start) an HTTP server for coalescing requests."""
+    coalescer = Coalescer(window, transport=transport, deadline=deadline, hedge=hedge)
+    return _ThreadingHTTPServer((host, port), _make_handler(coalescer))
+
+
+def serve(
+        host=HOST, port=PORT, window=WINDOW, transport="inline",
+        deadline=request.DEADLINE, hedge=None):
+    """Run a coalescing server until interrupted."""
+    httpd = make_server(host, port, window, transport, deadline, hedge)
+    LOGGER.info("Serving on http://%s:%d", *httpd.server_address[:2])
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
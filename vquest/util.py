@@ -61,3 +61,6 @@ class VquestError(Exception):
         self.message = message
         self.server_messages = server_messages
         super().__init__(self.message)
+
+class DeadlineError(VquestError):
+    """No response arrived for a request within its deadline."""
@@ -1,7 +1,8 @@
 """
 Common imports grouped here for convenience.
 """
-from .request import vquest
+from .request import vquest, TRANSPORTS, RETRIES, DEADLINE, CHUNK_SIZE
 from .config import DEFAULTS, OPTIONS, load_config, layer_configs
+from .result import VquestResult
 from .util import airr_to_fasta
 from .version import __version__